@@ -1,2 +1,2 @@
-__all__ = ["aws_url"]
+__all__ = ["aws_url", "aws_parse", "aws_item", "aws_http", "aws_async", "aws_bulk", "aws_throttle", "aws_cache", "aws_index", "aws_flight", "aws_future", "aws_fixtures", "aws_mock", "aws_stats", "aws_export", "aws_crawl", "aws_route", "aws_browse", "aws_fingerprint"]
 
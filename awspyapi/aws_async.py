@@ -0,0 +1,458 @@
+#! /usr/bin/env python
+'''
+    Non-blocking client for the Product Advertising API.
+
+    AwsSearch waits for each request to finish before it can send the next.
+    AsyncAwsSearch instead sends requests from a single asyncore event loop
+    so hundreds of lookups can be waiting on Amazon at once without a thread
+    for each one.  Every request is signed by AwsSigner and parsed by
+    parse_response, or parse_lazy, exactly as AwsSearch does it.
+
+    Each of do_search, do_item_lookup and lookup_many returns an AwsFuture
+    right away and the requests are carried out while run() is called:
+
+        client = AsyncAwsSearch(max_in_flight=50)
+        futures = [client.do_item_lookup(asin) for asin in asins]
+        client.run()
+        items = [f.result() for f in futures]
+'''
+import asyncore
+import collections
+import heapq
+import socket
+import sys
+import time
+import urlparse
+from cStringIO import StringIO
+from aws_search import AwsSearch, AwsLookupResult
+from aws_http import AwsHttpException, accept_encoding, decoder_for
+from aws_future import AwsFuture
+
+class _AwsRequest(asyncore.dispatcher):
+    '''
+        One HTTP/1.0 GET on its own socket.  Amazon closes the connection
+        after the response so the body is simply everything until then.  A
+        compressed body is decompressed as it arrives.  bytes_read is the
+        size of the body as it came over the wire, bytes_decoded its size
+        once decompressed.
+    '''
+    def __init__(self, client, url, callback):
+        asyncore.dispatcher.__init__(self, map=client._map)
+        self.client = client
+        self.callback = callback
+        self.header = None
+        self.decoder = None
+        self.chunks = []
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+        self.finished = False
+        self.started = time.time()
+        self.deadline = self.started + client.timeout
+        ''' When it connected, finished sending and got the first of the
+            response, for instrumentation '''
+        self.connected = None
+        self.sent = None
+        self.first_read = None
+        self.finished_at = None
+
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        if scheme != 'http':
+            raise AwsHttpException("Unsupported URL scheme '%s'" % scheme)
+        if query:
+            path = path + '?' + query
+        self.outgoing = 'GET %s HTTP/1.0\r\nHost: %s\r\n' % (path, netloc)
+        if client.compress:
+            self.outgoing += 'Accept-Encoding: %s\r\n' % accept_encoding
+        self.outgoing += '\r\n'
+        family, address = client._address(netloc)
+        self.create_socket(family, socket.SOCK_STREAM)
+        try:
+            self.connect(address)
+        except socket.error:
+            self.close()
+            raise
+
+    def handle_connect(self):
+        self.connected = time.time()
+
+    def writable(self):
+        return len(self.outgoing) > 0
+
+    def handle_write(self):
+        sent = self.send(self.outgoing)
+        self.outgoing = self.outgoing[sent:]
+        if len(self.outgoing) == 0:
+            self.sent = time.time()
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        if self.first_read == None:
+            self.first_read = time.time()
+        if self.header == None:
+            ''' Still waiting for the end of the headers '''
+            self.chunks.append(data)
+            data = ''.join(self.chunks)
+            header, sep, data = data.partition('\r\n\r\n')
+            if not sep:
+                self.chunks = [header]
+                return
+            self.header = header
+            self.chunks = []
+            self.decoder = decoder_for(_header_value(header, 'content-encoding'))
+            if not data:
+                return
+        self.bytes_read += len(data)
+        if self.decoder != None:
+            data = self.decoder.decompress(data)
+        self.bytes_decoded += len(data)
+        self.chunks.append(data)
+
+    def handle_close(self):
+        if self.header == None:
+            self._finish(''.join(self.chunks), None)
+            return
+        if self.decoder != None:
+            data = self.decoder.flush()
+            self.bytes_decoded += len(data)
+            self.chunks.append(data)
+        self._finish(self.header + '\r\n\r\n' + ''.join(self.chunks), None)
+
+    def handle_error(self):
+        self._finish(None, AwsHttpException("Request failed: %s" % str(sys.exc_info()[1])))
+
+    def _finish(self, data, exception):
+        if self.finished:
+            return
+        self.finished = True
+        self.finished_at = time.time()
+        self.close()
+        self.client._finished(self, data, exception)
+
+def _header_value(header, name):
+    ''' Value of the named header in the block of response headers or None '''
+    for line in header.split('\r\n')[1:]:
+        key, sep, value = line.partition(':')
+        if key.strip().lower() == name:
+            return value.strip()
+    return None
+
+class AsyncAwsSearch(object):
+    '''
+        Asynchronous version of AwsSearch.
+
+            max_in_flight   Most requests sent and waiting for a response at
+                            once.  Any more wait their turn in the order they
+                            were made.
+            timeout         Seconds to wait for a response before giving up
+            compress        Ask for the responses to be compressed
+            parser          'etree' or 'lazy' as for AwsSearch
+
+        The tag, key and secret are as for AwsSearch including getting them
+        from the environment if not given.  So is the limiter, which is the
+        AwsRateLimiter shared with AwsSearch unless one is given.  Throttled
+        requests are retried after backing off just as AwsSearch does.  If a
+        cache is given it is used just as AwsSearch uses it and so are
+        base_url, instrument and router.
+
+        A request identical to one already in flight, whether sent by this
+        loop or by a thread using an AwsSearch with the same flight, isn't
+        sent again but gets the response of that one.
+    '''
+    def __init__(self, tag=None, key=None, secret=None, max_in_flight=100, timeout=10.0,
+                    verbose=False, limiter=None, cache=None, flight=None, base_url=None,
+                    instrument=None, compress=True, router=None, parser='etree'):
+        self.search = AwsSearch(tag=tag, key=key, secret=secret, verbose=verbose, limiter=limiter,
+                                cache=cache, flight=flight, base_url=base_url, instrument=instrument,
+                                router=router, parser=parser)
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.compress = compress
+        self._map = {}
+        self._in_flight = set()
+        self._waiting = collections.deque()
+        self._scheduled = []
+        self._sequence = 0
+        self._addresses = {}
+        self._following = 0
+        self._completed = collections.deque()
+
+    def _address(self, netloc):
+        ''' Resolve each host only once rather than for every request '''
+        if netloc not in self._addresses:
+            host, sep, port = netloc.partition(':')
+            info = socket.getaddrinfo(host, int(port or 80), 0, socket.SOCK_STREAM)
+            self._addresses[netloc] = (info[0][0], info[0][4])
+        return self._addresses[netloc]
+
+    def _send(self, params, callback, attempt=0, fields=None):
+        ''' Queue the request for the given parameters.  callback(response, exception)
+            is called with the AwsResponse when it is done.  fields is the
+            frozenset of AwsItem fields to fill in or None for all. '''
+        instrument = self.search.instrument
+        if attempt == 0:
+            if instrument != None:
+                callback = self._timed(callback)
+            key = self.search._cache_key(params, fields)
+            if self.search.cache != None:
+                response = self.search.cache.get(key)
+                if instrument != None:
+                    instrument.count('cache_hits' if response != None else 'cache_misses')
+                if response != None:
+                    callback(response, None)
+                    return
+            if not self.search.flight.begin(key, self._follow(callback)):
+                if instrument != None:
+                    instrument.count('coalesced')
+                self._following += 1
+                return
+            callback = self._lead(key, callback)
+        self._waiting.append((params, callback, attempt, fields))
+        self._start()
+
+    def _timed(self, callback):
+        ''' Callback that tells the instrument the total time first '''
+        instrument = self.search.instrument
+        start = time.time()
+        def done(response, exception):
+            instrument.timing('total', time.time() - start)
+            callback(response, exception)
+        return done
+
+    def _lead(self, key, callback):
+        ''' Callback for the leader of a flight which passes the result on
+            to the requests waiting for it '''
+        flight = self.search.flight
+        def done(response, exception):
+            flight.finish(key, response, exception)
+            callback(response, exception)
+        return done
+
+    def _follow(self, callback):
+        ''' Callback for a request waiting on an identical one.  The leader
+            may finish in another thread so the callback is only queued here
+            and called from run. '''
+        def done(response, exception):
+            self._completed.append((callback, response, exception))
+        return done
+
+    def _run_completed(self):
+        while self._completed:
+            callback, response, exception = self._completed.popleft()
+            self._following -= 1
+            callback(response, exception)
+
+    def _start(self):
+        ''' Move waiting requests along as far as max_in_flight allows.  Each
+            takes a token from the rate limiter and if it has to wait for it,
+            it is scheduled for later rather than blocking the loop. '''
+        router = self.search.router
+        while self._waiting and len(self._in_flight) + len(self._scheduled) < self.max_in_flight:
+            params, callback, attempt, fields = self._waiting.popleft()
+            ''' With a router the token is taken from the credential the
+                request is then signed with '''
+            credential = None
+            if router != None:
+                credential = router.choose()
+                delay = credential.limiter.reserve()
+            else:
+                delay = self.search.limiter.reserve()
+            if delay > 0:
+                self._sequence += 1
+                heapq.heappush(self._scheduled, (time.time() + delay, self._sequence, params, callback,
+                                                 attempt, fields, credential))
+            else:
+                self._connect(params, callback, attempt, fields, credential)
+
+    def _start_scheduled(self):
+        now = time.time()
+        chosen_again = False
+        while self._scheduled and self._scheduled[0][0] <= now:
+            when, sequence, params, callback, attempt, fields, credential = heapq.heappop(self._scheduled)
+            if credential != None and credential.disabled_until > now:
+                ''' Its credential was rejected while it waited '''
+                self._waiting.appendleft((params, callback, attempt, fields))
+                chosen_again = True
+                continue
+            self._connect(params, callback, attempt, fields, credential)
+        if chosen_again:
+            self._start()
+
+    def _connect(self, params, callback, attempt, fields, credential=None):
+        ''' Signed only now since the Timestamp has to be recent when it gets to Amazon '''
+        instrument = self.search.instrument
+        if instrument != None:
+            start = time.time()
+        if credential != None:
+            url_signed = credential.signer.sign(params)
+            self.search.router.sent(credential)
+        else:
+            url_signed = self.search._signed_url(params)
+        if instrument != None:
+            instrument.timing('sign', time.time() - start)
+        try:
+            request = _AwsRequest(self, url_signed, callback)
+        except (socket.error, AwsHttpException) as e:
+            callback(None, AwsHttpException("Request failed: %s" % str(e)))
+            return
+        request.params = params
+        request.attempt = attempt
+        request.fields = fields
+        request.credential = credential
+        self._in_flight.add(request)
+
+    def _finished(self, request, data, exception):
+        self._in_flight.discard(request)
+        response = None
+        instrument = self.search.instrument
+        if instrument != None:
+            instrument.count('requests')
+            if request.attempt > 0:
+                instrument.count('retries')
+        if exception == None:
+            try:
+                if instrument != None:
+                    response = self._instrumented_parse(request, data)
+                else:
+                    response = self._parse(data, None, request.fields)
+            except Exception as e:
+                exception = e
+        limiter = self.search.limiter
+        if response != None and request.credential != None:
+            if self.search.router.should_retry(request.credential, response.errors, request.attempt):
+                ''' Go to the back of the line, probably to be sent with
+                    another credential '''
+                self._send(request.params, request.callback, request.attempt + 1, request.fields)
+                return
+        elif response != None and limiter.is_throttled(response.errors) and request.attempt < limiter.max_retries:
+            ''' Back off and go to the back of the line '''
+            limiter.backoff(request.attempt)
+            self._send(request.params, request.callback, request.attempt + 1, request.fields)
+            return
+        if instrument != None and response != None:
+            for code in response.errors:
+                instrument.count('error.' + code)
+        if response != None:
+            if request.credential == None and not limiter.is_throttled(response.errors):
+                ''' Still throttled after max_retries isn't a success '''
+                limiter.succeeded()
+            if self.search.cache != None:
+                self.search.cache.put(self.search._cache_key(request.params, request.fields),
+                        request.params['Operation'], response, request.bytes_decoded)
+        self._start()
+        request.callback(response, exception)
+
+    def _instrumented_parse(self, request, data):
+        ''' _parse telling the instrument how long each part of the request took '''
+        instrument = self.search.instrument
+        if request.connected != None:
+            instrument.timing('connect', request.connected - request.started)
+        if request.first_read != None and request.sent != None:
+            instrument.timing('ttfb', request.first_read - request.sent)
+            instrument.timing('download', request.finished_at - request.first_read)
+        instrument.count('bytes', request.bytes_read)
+        timings = {'extract': 0.0}
+        start = time.time()
+        response = self._parse(data, timings, request.fields)
+        instrument.timing('parse', time.time() - start - timings['extract'])
+        instrument.timing('extract', timings['extract'])
+        return response
+
+    def _parse(self, data, timings=None, fields=None):
+        header, sep, body = data.partition('\r\n\r\n')
+        lines = header.split('\r\n')
+        status = lines[0].split(' ', 2)
+        if len(status) < 2 or not status[0].startswith('HTTP/'):
+            raise AwsHttpException("Bad response from server")
+        content_type = _header_value(header, 'content-type') or ''
+        if int(status[1]) >= 400 and 'xml' not in content_type:
+            raise AwsHttpException("Request failed: %s" % lines[0])
+        return self.search.response_parser(StringIO(body), timings, fields)
+
+    def _expire(self):
+        now = time.time()
+        for request in list(self._in_flight):
+            if now > request.deadline:
+                request._finish(None, AwsHttpException("Request timed out"))
+
+    def run(self, until=None):
+        '''
+            Carry out the requests until they're all done or, if given, the
+            AwsFuture until is done.  New requests may be made from callbacks
+            while this is running.
+        '''
+        while self._in_flight or self._waiting or self._scheduled or self._following:
+            self._run_completed()
+            if until != None and until.done():
+                break
+            timeout = 0.1
+            if self._completed:
+                timeout = 0.0
+            elif self._scheduled:
+                timeout = max(0.0, min(timeout, self._scheduled[0][0] - time.time()))
+            if self._map:
+                asyncore.loop(timeout=timeout, map=self._map, count=1)
+            else:
+                time.sleep(timeout)
+            self._start_scheduled()
+            self._expire()
+
+    def do_search(self, search_index, search_params, group='Images,ItemAttributes', fields=None):
+        ''' An ItemSearch.  The AwsFuture returned gets the AwsResponse.  fields
+            is as for AwsSearch.do_item_lookup. '''
+        future = AwsFuture()
+        def done(response, exception):
+            if exception != None:
+                future.set_exception(exception)
+            else:
+                future.set_result(response)
+        group, fields = self.search._group_for(group, fields)
+        self._send(self.search._search_params(search_index, search_params, group), done, fields=fields)
+        return future
+
+    def do_item_lookup(self, asin, group='Images,ItemAttributes,EditorialReview', fields=None):
+        ''' An ItemLookup of one ASIN.  The AwsFuture returned gets the AwsItem
+            or None if it wasn't found. '''
+        future = AwsFuture()
+        def done(response, exception):
+            if exception != None:
+                future.set_exception(exception)
+            elif len(response) > 0:
+                future.set_result(response[0])
+            else:
+                future.set_result(None)
+        group, fields = self.search._group_for(group, fields)
+        self._send(self.search._lookup_params([asin], group), done, fields=fields)
+        return future
+
+    def lookup_many(self, asins, group='Images,ItemAttributes,EditorialReview', fields=None):
+        '''
+            Like AwsSearch.lookup_many but all of the ItemLookup requests of 10
+            ASINs are sent at once, limited only by max_in_flight.  The AwsFuture
+            returned gets the AwsLookupResult when the last of them is done.
+        '''
+        group, fields = self.search._group_for(group, fields)
+        future = AwsFuture()
+        result = AwsLookupResult()
+        batches = list(self.search._lookup_batches(asins))
+        if len(batches) == 0:
+            future.set_result(result)
+            return future
+
+        remaining = [len(batches)]
+        def make_done(batch):
+            def done(response, exception):
+                if future.done():
+                    return
+                if exception != None:
+                    future.set_exception(exception)
+                    return
+                result.collect(batch, response)
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    future.set_result(result)
+            return done
+        for batch in batches:
+            self._send(self.search._lookup_params(batch, group), make_done(batch), fields=fields)
+        return future
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+'''
+    Crawl the browse node tree and keep it compactly.
+
+    AwsBrowseCrawler walks down from some root BrowseNodeIds a level at a
+    time.  The nodes of each level are looked up 10 to a BrowseNodeLookup
+    with several lookups in flight at once, each waiting its turn with the
+    rate limiter of the AwsSearch.  The result is an AwsBrowseTree which
+    keeps the ids and the parent and child links in flat arrays rather
+    than an object per node.
+
+    Browse nodes hardly change so there's no need to look them all up
+    again every time.  resync gives a new tree, only looking up the nodes
+    that were fetched longer than ttl seconds ago:
+
+        crawler = AwsBrowseCrawler(search, ttl=7 * 86400)
+        tree = crawler.crawl([283155])
+        ...
+        tree = crawler.resync(tree)
+'''
+import array
+import time
+from multiprocessing.pool import ThreadPool
+from aws_search import AwsSearch
+
+class AwsBrowseTree(object):
+    '''
+        Browse node tree in breadth first order.  Each node is a position in
+        these arrays and the children of a node are next to each other.
+
+            ids             BrowseNodeId of each node
+            names           Name of each node, a list
+            parents         Position of the parent, -1 for a root
+            first_child     Position of the first child
+            child_count     Number of children
+            fetched         Time the node was last looked up, 0.0 if it
+                            never was, like the nodes below max_depth
+
+        Only the dictionary from id to position isn't flat and it isn't
+        pickled but made again when unpickled.
+    '''
+    def __init__(self):
+        self.ids = array.array('l')
+        self.names = []
+        self.parents = array.array('l')
+        self.first_child = array.array('l')
+        self.child_count = array.array('l')
+        self.fetched = array.array('d')
+        self._positions = {}
+
+    def _add(self, node_id, name, parent=-1, fetched=0.0):
+        ''' Append a node.  The children of a parent have to be added one
+            after the other. '''
+        position = len(self.ids)
+        self.ids.append(node_id)
+        self.names.append(name)
+        self.parents.append(parent)
+        self.first_child.append(0)
+        self.child_count.append(0)
+        self.fetched.append(fetched)
+        self._positions[node_id] = position
+        if parent >= 0:
+            if self.child_count[parent] == 0:
+                self.first_child[parent] = position
+            self.child_count[parent] += 1
+        return position
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node_id):
+        return node_id in self._positions
+
+    def position(self, node_id):
+        ''' Position of the node, raising KeyError if it isn't in the tree '''
+        return self._positions[node_id]
+
+    def name(self, node_id):
+        return self.names[self._positions[node_id]]
+
+    def fetched_at(self, node_id):
+        return self.fetched[self._positions[node_id]]
+
+    def parent(self, node_id):
+        ''' BrowseNodeId of the parent or None for a root '''
+        parent = self.parents[self._positions[node_id]]
+        if parent < 0:
+            return None
+        return self.ids[parent]
+
+    def children(self, node_id):
+        ''' List of the BrowseNodeIds of the children '''
+        position = self._positions[node_id]
+        first = self.first_child[position]
+        return self.ids[first:first + self.child_count[position]].tolist()
+
+    def ancestors(self, node_id):
+        ''' List of the BrowseNodeIds from the parent up to the root '''
+        ancestors = []
+        parent = self.parents[self._positions[node_id]]
+        while parent >= 0:
+            ancestors.append(self.ids[parent])
+            parent = self.parents[parent]
+        return ancestors
+
+    def roots(self):
+        return [self.ids[i] for i in xrange(len(self.ids)) if self.parents[i] < 0]
+
+    def stale(self, ttl, now=None):
+        ''' BrowseNodeIds of the nodes looked up more than ttl seconds ago '''
+        if now == None:
+            now = time.time()
+        oldest = now - ttl
+        return [self.ids[i] for i in xrange(len(self.ids)) if self.fetched[i] < oldest]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_positions']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._positions = dict((node_id, i) for i, node_id in enumerate(self.ids))
+
+class AwsBrowseCrawler(object):
+    '''
+        Breadth first crawler of browse nodes.
+
+            search          The AwsSearch to look them up with.  If not given
+                            one is made, getting the credentials from the
+                            environment.
+            threads         Most BrowseNodeLookups in flight at once
+            ttl             Seconds a node looked up is good for in resync
+            max_depth       Levels below the roots to look up, None for all
+
+        After each crawl lookups is the number of BrowseNodeLookups made,
+        fetched the number of nodes looked up, reused the number taken from
+        the old tree and errors maps each node that couldn't be looked up
+        to the error code or exception.  A node that couldn't be looked up
+        keeps what the old tree had for it.
+    '''
+    def __init__(self, search=None, threads=4, ttl=86400, max_depth=None):
+        if search == None:
+            search = AwsSearch()
+        self.search = search
+        self.threads = threads
+        self.ttl = ttl
+        self.max_depth = max_depth
+        self.lookups = 0
+        self.fetched = 0
+        self.reused = 0
+        self.errors = {}
+
+    def _lookup(self, batch):
+        ''' (batch, AwsResponse, exception) for one BrowseNodeLookup, run on a
+            thread of the pool '''
+        try:
+            return batch, self.search.browse_node_lookup(batch), None
+        except Exception as e:
+            return batch, None, e
+
+    def _lookup_all(self, pool, node_ids):
+        ''' Dictionary of BrowseNodeId to AwsBrowseNode for all of node_ids
+            that could be looked up '''
+        size = self.search.max_browse_nodes
+        batches = [node_ids[i:i + size] for i in range(0, len(node_ids), size)]
+        found = {}
+        for batch, response, exception in pool.imap(self._lookup, batches):
+            self.lookups += 1
+            if exception != None:
+                for node_id in batch:
+                    self.errors[node_id] = '%s: %s' % (exception.__class__.__name__, str(exception))
+                continue
+            for node in response:
+                found[node.id] = node
+            for node_id in batch:
+                if node_id not in found:
+                    self.errors[node_id] = response.errors[0] if response.errors else 'NotReturned'
+        return found
+
+    def crawl(self, roots, tree=None):
+        '''
+            Crawl down from the root BrowseNodeIds and return the AwsBrowseTree.
+            If the tree of an earlier crawl is given the nodes of it looked
+            up within the last ttl seconds are taken from it instead.
+        '''
+        self.lookups = 0
+        self.fetched = 0
+        self.reused = 0
+        self.errors = {}
+        now = time.time()
+        new = AwsBrowseTree()
+        names = {}
+        level = [(node_id, -1) for node_id in roots]
+        depth = 0
+        pool = ThreadPool(self.threads)
+        try:
+            while level:
+                expand = self.max_depth == None or depth < self.max_depth
+                wanted = []
+                if expand:
+                    for node_id, parent in level:
+                        if tree == None or node_id not in tree or tree.fetched_at(node_id) < now - self.ttl:
+                            wanted.append(node_id)
+                found = self._lookup_all(pool, wanted)
+                self.fetched += len(found)
+
+                next_level = []
+                for node_id, parent in level:
+                    if node_id in new:
+                        ''' Already somewhere else in the tree '''
+                        continue
+                    children = []
+                    if node_id in found:
+                        node = found[node_id]
+                        position = new._add(node_id, node.name, parent, now)
+                        children = node.children
+                    elif tree != None and node_id in tree and tree.fetched_at(node_id) > 0:
+                        position = new._add(node_id, tree.name(node_id), parent, tree.fetched_at(node_id))
+                        children = [(child, tree.name(child)) for child in tree.children(node_id)]
+                        self.reused += 1
+                    else:
+                        position = new._add(node_id, names.get(node_id), parent)
+                    if expand:
+                        for child, name in children:
+                            names[child] = name
+                            next_level.append((child, position))
+                level = next_level
+                depth += 1
+        finally:
+            pool.close()
+        return new
+
+    def resync(self, tree):
+        ''' A new tree from the roots of tree only looking up its nodes that
+            are older than ttl and the new nodes found under them '''
+        return self.crawl(tree.roots(), tree)
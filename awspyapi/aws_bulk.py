@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+'''
+    Run a mix of ItemSearch and ItemLookup requests on a pool of threads.
+
+    do_search and do_item_lookup keep their results in the AwsSearch so one
+    AwsSearch can't be used from several threads at once.  BulkExecutor only
+    uses AwsSearch.search and AwsSearch.item_lookup which keep nothing so
+    every thread can share the one AwsSearch, and its connection pool.
+
+    This needs concurrent.futures which is in the futures package for
+    Python 2, installed by the bulk extra, python-amazon-api[bulk].  For
+    code that can't use threads at all see aws_async.
+'''
+from aws_search import AwsSearch, AwsSearchException
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError:
+    ThreadPoolExecutor = None
+
+class BulkResult(object):
+    '''
+        Result of one request made by BulkExecutor
+
+            key         The key of the request it was made for
+            response    The AwsResponse or None if it failed
+            errors      The error codes as returned by get_errors, so a
+                        list of strings or None
+            exception   The exception if the request failed else None
+    '''
+    __slots__ = ('key', 'response', 'errors', 'exception')
+
+    def __init__(self, key, response=None, exception=None):
+        self.key = key
+        self.response = response
+        self.exception = exception
+        if response != None and len(response.errors) > 0:
+            self.errors = list(response.errors)
+        else:
+            self.errors = None
+
+    def item(self):
+        ''' The first AwsItem of the response, which is the one for a lookup, or None '''
+        if self.response == None or len(self.response) == 0:
+            return None
+        return self.response[0]
+
+    def __repr__(self):
+        return '<BulkResult %r errors=%r exception=%r>' % (self.key, self.errors, self.exception)
+
+class BulkExecutor(object):
+    '''
+        Carry out requests on a ThreadPoolExecutor.  Each request given to run
+        may be
+
+            'B000FBJAGO'                    An ASIN to look up.  The key is the ASIN.
+            {'asin': 'B000FBJAGO'}          The same but may also have 'group' for
+                                            the ResponseGroup, 'fields' for the
+                                            AwsItem fields wanted and 'key'
+            {'search_index': 'Books',       An ItemSearch.  It too may have 'group',
+             'search_params': {...}}        'fields' and 'key'.  Without a key it is
+                                            the search index and sorted parameters.
+
+        The search is the AwsSearch to use.  If not given one is made, getting
+        the credentials from the environment.  Rather than the executor made
+        from max_workers one can be given which is left running when done.
+    '''
+    def __init__(self, search=None, max_workers=4, executor=None):
+        if search == None:
+            search = AwsSearch()
+        self.search = search
+        self.max_workers = max_workers
+        self.executor = executor
+
+    def _key(self, spec):
+        if isinstance(spec, basestring):
+            return spec
+        if 'key' in spec:
+            return spec['key']
+        if 'asin' in spec:
+            return spec['asin']
+        return (spec['search_index'], tuple(sorted(spec['search_params'].items())))
+
+    def _call(self, spec):
+        ''' Run one request in a worker thread and return its BulkResult '''
+        key = self._key(spec)
+        try:
+            if isinstance(spec, basestring):
+                response = self.search.item_lookup(spec)
+            elif 'asin' in spec:
+                if 'group' in spec:
+                    response = self.search.item_lookup(spec['asin'], spec['group'], spec.get('fields'))
+                else:
+                    response = self.search.item_lookup(spec['asin'], fields=spec.get('fields'))
+            else:
+                if 'group' in spec:
+                    response = self.search.search(spec['search_index'], spec['search_params'], spec['group'],
+                                                  spec.get('fields'))
+                else:
+                    response = self.search.search(spec['search_index'], spec['search_params'],
+                                                  fields=spec.get('fields'))
+        except Exception as e:
+            return BulkResult(key, exception=e)
+        return BulkResult(key, response)
+
+    def run(self, specs):
+        '''
+            Generator that yields a BulkResult for each request as they finish,
+            which is not necessarily the order given.  Only a couple of requests
+            for each worker are submitted ahead so specs may be a generator
+            of any length.
+        '''
+        if ThreadPoolExecutor == None:
+            raise AwsSearchException("BulkExecutor needs concurrent.futures.  Please install the futures package, or python-amazon-api[bulk]")
+        executor = self.executor
+        if executor == None:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            pending = set()
+            for spec in specs:
+                pending.add(executor.submit(self._call, spec))
+                if len(pending) >= 2 * self.max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            if executor is not self.executor:
+                executor.shutdown(wait=False)
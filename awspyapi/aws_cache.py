@@ -0,0 +1,332 @@
+#! /usr/bin/env python
+'''
+    Caching of parsed responses.
+
+    The same search or lookup is often repeated within minutes and each
+    time costs a signed request that counts against the rate limit plus
+    parsing the response.  A cache given to AwsSearch is asked first, with
+    the request's AwsSigner.canonical_query as the key, and a hit skips both.
+
+    Any object with the same get and put methods as AwsMemoryCache can be
+    used as a cache, and within AwsTieredCache its entry method too.
+    AwsSqliteCache keeps responses on disk so they survive a restart and
+    are shared by all the processes on a host, and AwsTieredCache puts an
+    AwsMemoryCache in front of it.
+'''
+import cPickle as pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class AwsMemoryCache(object):
+    '''
+        In memory LRU cache of parsed responses.
+
+            max_entries     Most responses kept
+            max_bytes       Most total size of the responses kept, as measured
+                            by the size of the XML they were parsed from
+            ttl             Seconds a response is kept for
+            ttls            Dictionary of Operation to seconds for operations
+                            that should be kept for some other time.  0 means
+                            don't cache that operation at all.
+
+        The least recently used responses are evicted when either maximum is
+        reached.  The hits, misses, evictions and expirations are counted and
+        stats returns them all in a dictionary.
+    '''
+    # Error codes that only say something about that one try, or that the
+    # whole request was refused for its signature, timestamp or credentials,
+    # so a response with them must not be cached
+    uncacheable_codes = set(['AWS.RequestThrottled', 'RequestThrottled',
+                             'AWS.InternalError', 'InternalError',
+                             'SignatureDoesNotMatch', 'InvalidClientTokenId', 'RequestExpired',
+                             'MissingParameter', 'MissingAuthenticationToken',
+                             'AWS.InvalidAccount', 'AWS.InvalidAssociate'])
+
+    def __init__(self, max_entries=1000, max_bytes=64*1024*1024, ttl=3600, ttls={}):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.ttls = dict(ttls)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def cacheable(self, response):
+        ''' False if the response has errors that mean it shouldn't be kept '''
+        for code in response.errors:
+            if code in self.uncacheable_codes:
+                return False
+        return True
+
+    def get(self, key):
+        ''' The response for key or None if it isn't cached or has expired '''
+        entry = self.entry(key)
+        if entry == None:
+            return None
+        return entry[0]
+
+    def entry(self, key):
+        ''' (response, operation, size, expires) for key or None like get.
+            size is the size of the XML and expires the time it expires. '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry == None:
+                self.misses += 1
+                return None
+            expires, operation, size, value = entry
+            if expires < time.time():
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            ''' Put it back at the most recently used end '''
+            self._entries[key] = entry
+            self.hits += 1
+            return value, operation, size, expires
+
+    def put(self, key, operation, value, size, expires=None):
+        ''' Keep the response for key which is for the given Operation and was
+            parsed from size bytes.  It expires after the ttl of the operation
+            unless an earlier time it expires is given, as AwsTieredCache does
+            for a response copied from another cache. '''
+        ttl = self.ttls.get(operation, self.ttl)
+        if ttl <= 0 or size > self.max_bytes or not self.cacheable(value):
+            return
+        now = time.time()
+        if expires == None or expires > now + ttl:
+            expires = now + ttl
+        if expires <= now:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old != None:
+                self._bytes -= old[2]
+            self._entries[key] = (expires, operation, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest, entry = self._entries.popitem(last=False)
+                self._bytes -= entry[2]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations}
+
+class AwsSqliteCache(object):
+    '''
+        Cache of parsed responses in an sqlite database so they survive the
+        process and can be shared by several processes on the same host.  The
+        database is in WAL mode so readers don't block each other or the one
+        writer.  Each thread gets its own connection.
+
+            path            The database file which is created if need be
+            max_bytes       Most total size of the pickled responses, which
+                            isn't the size of the XML that AwsMemoryCache
+                            counts.  Once over, the next compaction removes
+                            the least recently used until it isn't.
+            ttl, ttls       As for AwsMemoryCache
+            compact_every   Check the size after this many puts
+
+        When a response is read its last used time is only written again if
+        it is more than touch_interval seconds old so reads stay reads.
+        Responses are pickled so only use a database you trust.
+    '''
+    uncacheable_codes = AwsMemoryCache.uncacheable_codes
+    touch_interval = 300
+
+    def __init__(self, path, max_bytes=512*1024*1024, ttl=3600, ttls={}, compact_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.ttls = dict(ttls)
+        self.compact_every = compact_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        db = self._db()
+        with db:
+            db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY, operation TEXT, expires REAL,
+                            used REAL, size INTEGER, data BLOB)''')
+            columns = [row[1] for row in db.execute('PRAGMA table_info(responses)')]
+            if 'xml_size' not in columns:
+                ''' The size given to put, kept since databases from before it was '''
+                db.execute('ALTER TABLE responses ADD COLUMN xml_size INTEGER')
+            db.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+            db.execute('CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)')
+
+    def _db(self):
+        ''' The connection for this thread '''
+        db = getattr(self._local, 'db', None)
+        if db == None:
+            db = sqlite3.connect(self.path, timeout=30.0)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def cacheable(self, response):
+        for code in response.errors:
+            if code in self.uncacheable_codes:
+                return False
+        return True
+
+    def get(self, key):
+        ''' The response for key or None if it isn't cached or has expired '''
+        entry = self.entry(key)
+        if entry == None:
+            return None
+        return entry[0]
+
+    def entry(self, key):
+        ''' (response, operation, size, expires) for key or None like get.
+            size is the size of the XML given to put, or the pickled size for
+            a response kept before that was, so it is the same as the size
+            AwsMemoryCache counts. '''
+        db = self._db()
+        row = db.execute('SELECT operation, expires, used, size, xml_size, data FROM responses WHERE key = ?',
+                         (key,)).fetchone()
+        if row == None:
+            self._count('misses')
+            return None
+        operation, expires, used, size, xml_size, data = row
+        now = time.time()
+        if expires < now:
+            self._count('expirations')
+            self._count('misses')
+            return None
+        if now - used > self.touch_interval:
+            with db:
+                db.execute('UPDATE responses SET used = ? WHERE key = ?', (now, key))
+        self._count('hits')
+        if xml_size == None:
+            xml_size = size
+        return pickle.loads(str(data)), operation, xml_size, expires
+
+    def put(self, key, operation, value, size, expires=None):
+        ''' Keep the response for key which is for the given Operation.  The size
+            counted against max_bytes is that of the pickled response while
+            size, the size of the XML, is only kept for entry.  expires is as
+            for AwsMemoryCache.put. '''
+        ttl = self.ttls.get(operation, self.ttl)
+        if ttl <= 0 or not self.cacheable(value):
+            return
+        now = time.time()
+        if expires == None or expires > now + ttl:
+            expires = now + ttl
+        if expires <= now:
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        db = self._db()
+        with db:
+            db.execute('''INSERT OR REPLACE INTO responses (key, operation, expires, used, size, xml_size, data)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                       (key, operation, expires, now, len(data), size, sqlite3.Binary(data)))
+        with self._lock:
+            self._puts += 1
+            compact = self._puts % self.compact_every == 0
+        if compact:
+            self.compact()
+
+    def compact(self, vacuum=False):
+        '''
+            Remove the expired responses and then the least recently used ones
+            until the total size is at most max_bytes.  With vacuum the file
+            is also shrunk, which locks out everybody while it is done.
+        '''
+        db = self._db()
+        with db:
+            cursor = db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+            expired = cursor.rowcount
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                doomed = []
+                for key, size in db.execute('SELECT key, size FROM responses ORDER BY used'):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                db.executemany('DELETE FROM responses WHERE key = ?', doomed)
+                evicted = len(doomed)
+        with self._lock:
+            self.expirations += max(expired, 0)
+            self.evictions += evicted
+        if vacuum:
+            db.execute('VACUUM')
+
+    def clear(self):
+        db = self._db()
+        with db:
+            db.execute('DELETE FROM responses')
+
+    def stats(self):
+        entries, total = self._db().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        with self._lock:
+            return {'entries': entries, 'bytes': total,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations}
+
+class AwsTieredCache(object):
+    '''
+        Several caches, fastest first, such as an AwsMemoryCache in front of an
+        AwsSqliteCache.  A response found in a later cache is copied into the
+        ones before it, expiring when it does there, and a put goes to all
+        of them.  Each cache keeps to its own max_bytes in its own terms,
+        the size of the XML for AwsMemoryCache and of the pickled response
+        for AwsSqliteCache.
+    '''
+    def __init__(self, *caches):
+        self.caches = caches
+
+    def get(self, key):
+        entry = self.entry(key)
+        if entry == None:
+            return None
+        return entry[0]
+
+    def entry(self, key):
+        for i, cache in enumerate(self.caches):
+            entry = cache.entry(key)
+            if entry != None:
+                response, operation, size, expires = entry
+                for earlier in self.caches[:i]:
+                    earlier.put(key, operation, response, size, expires)
+                return entry
+        return None
+
+    def put(self, key, operation, value, size, expires=None):
+        for cache in self.caches:
+            cache.put(key, operation, value, size, expires)
+
+    def clear(self):
+        for cache in self.caches:
+            cache.clear()
+
+    def stats(self):
+        ''' List of the stats of each cache '''
+        return [cache.stats() for cache in self.caches]
@@ -0,0 +1,195 @@
+#! /usr/bin/env python
+'''
+    Crawl lots of ASINs and searches with a pool of processes.
+
+    Parsing responses is CPU bound so however many threads AwsSearch,
+    BulkExecutor or AsyncAwsSearch use, one process only gets one core.
+    AwsCrawler splits the work over a multiprocessing Pool instead.  Each
+    worker has its own AwsSearch and AwsConnectionPool and parses its own
+    responses, and only sends back compact records, tuples of the values of
+    some columns as for aws_export, rather than AwsItems or documents:
+
+        crawler = AwsCrawler(processes=8, rate=1.0, columns=('asin', 'title', 'list_price'))
+        for record in crawler.lookup(asins):
+            ...
+        crawler.close()
+
+    All of the workers take their turn from one AwsRateLimiter kept by a
+    multiprocessing Manager, so together they stay within the rate allowed
+    however many there are.
+'''
+import multiprocessing
+from multiprocessing.managers import BaseManager
+from aws_search import AwsSearch
+from aws_http import AwsConnectionPool
+from aws_throttle import AwsRateLimiter
+from aws_export import default_columns, column_fields, row_getter
+
+class _AwsCrawlManager(BaseManager):
+    pass
+
+_AwsCrawlManager.register('AwsRateLimiter', AwsRateLimiter)
+
+class _SharedLimiter(AwsRateLimiter):
+    '''
+        The AwsRateLimiter of a worker.  Tokens, backing off and speeding
+        back up are all done by the one shared limiter, through its proxy,
+        so every worker sees the others' requests.  Waiting and retrying are
+        done in the worker.
+    '''
+    def __init__(self, shared, max_retries):
+        AwsRateLimiter.__init__(self, max_retries=max_retries)
+        self.shared = shared
+
+    def reserve(self):
+        return self.shared.reserve()
+
+    def succeeded(self):
+        self.shared.succeeded()
+
+    def backoff(self, attempt):
+        return self.shared.backoff(attempt)
+
+''' What each worker process works with, set up by _init_worker '''
+_worker = None
+
+class _AwsCrawlWorker(object):
+    def __init__(self, settings, shared):
+        self.search = AwsSearch(tag=settings['tag'], key=settings['key'], secret=settings['secret'],
+                                limiter=_SharedLimiter(shared, settings['max_retries']),
+                                transport=AwsConnectionPool(), base_url=settings['base_url'])
+        self.columns = settings['columns']
+        self.group = settings['group']
+        self.fields = settings['fields']
+        self.row = row_getter(self.columns)
+
+    def lookup(self, asins):
+        result = self.search.lookup_many(asins, self.group, self.fields)
+        row = self.row
+        records = [row(result[asin]) for asin in asins if result.get(asin) != None]
+        return records, result.errors
+
+    def search_pages(self, spec, key):
+        errors = []
+        items = self.search.iter_search(spec['search_index'], spec['search_params'],
+                                        spec.get('max_pages', 10), self.group, fields=self.fields,
+                                        errors=errors)
+        row = self.row
+        records = [row(item) for item in items]
+        if errors:
+            return records, {key: errors[0]}
+        return records, {}
+
+def _init_worker(settings, shared):
+    global _worker
+    _worker = _AwsCrawlWorker(settings, shared)
+
+def _run_task(task):
+    ''' Carry out one task in a worker and return (key, records, errors) where
+        errors maps ASINs, or the search, to the error code.  If a lookup
+        fails every ASIN of it gets the exception. '''
+    kind, key, work = task
+    try:
+        if kind == 'lookup':
+            records, errors = _worker.lookup(work)
+        else:
+            records, errors = _worker.search_pages(work, key)
+    except Exception as e:
+        error = '%s: %s' % (e.__class__.__name__, str(e))
+        if kind == 'lookup':
+            return key, [], dict((asin, error) for asin in work)
+        return key, [], {key: error}
+    return key, records, errors
+
+class AwsCrawler(object):
+    '''
+        Runs lookups and searches on a pool of worker processes.
+
+            processes       Worker processes, by default one for each CPU
+            rate, burst     Of the AwsRateLimiter shared by all the workers
+            max_retries     Times a throttled request is retried
+            columns         The record of each item is the tuple of these
+                            columns, see aws_export.  Only the fields they
+                            need are asked for and parsed unless group is
+                            given.
+            group           ResponseGroup to use instead
+            chunksize       Tasks handed to a worker at a time
+            base_url        As for AwsSearch
+
+        The tag, key and secret are as for AwsSearch including getting them
+        from the environment if not given.  The ASINs and searches that
+        failed are kept in the errors dictionary, mapped to the error code
+        or exception.  The pool is started when first needed and close()
+        stops it.
+    '''
+    def __init__(self, tag=None, key=None, secret=None, processes=None, rate=1.0, burst=1,
+                    max_retries=5, columns=default_columns, group=None, chunksize=4,
+                    base_url=None):
+        columns = tuple(columns)
+        fields = None
+        if group == None:
+            group, fields = AwsSearch.response_groups(column_fields(columns))
+        self.settings = {'tag': tag, 'key': key, 'secret': secret, 'max_retries': max_retries,
+                         'columns': columns, 'group': group, 'fields': fields,
+                         'base_url': base_url}
+        self.columns = columns
+        self.processes = processes or multiprocessing.cpu_count()
+        self.rate = rate
+        self.burst = burst
+        self.chunksize = chunksize
+        self.errors = {}
+        self.records = 0
+        self._manager = None
+        self._pool = None
+
+    def _start(self):
+        if self._pool != None:
+            return
+        self._manager = _AwsCrawlManager()
+        self._manager.start()
+        self.limiter = self._manager.AwsRateLimiter(rate=self.rate, burst=self.burst)
+        self._pool = multiprocessing.Pool(self.processes, _init_worker, (self.settings, self.limiter))
+
+    def _run(self, tasks):
+        self._start()
+        for key, records, errors in self._pool.imap_unordered(_run_task, tasks, self.chunksize):
+            self.errors.update(errors)
+            self.records += len(records)
+            for record in records:
+                yield record
+
+    def _lookup_tasks(self, asins):
+        ''' ASINs in lists of 10, the most one ItemLookup takes, without
+            blanks or duplicates as for AwsSearch.lookup_many '''
+        for batch in AwsSearch._lookup_batches(asins):
+            yield ('lookup', batch[0], batch)
+
+    def lookup(self, asins):
+        '''
+            Generator of the record of each of the ASINs found, in no
+            particular order.  asins may be a generator of any length as
+            the ASINs are only taken as the workers are ready for them.
+        '''
+        return self._run(self._lookup_tasks(asins))
+
+    def search(self, specs):
+        '''
+            Generator of the record of every item of every page of each
+            search, in no particular order.  Each spec is a dictionary with
+            'search_index' and 'search_params' and maybe 'max_pages'.  A
+            search that fails is in errors keyed by its search index and
+            sorted parameters.
+        '''
+        tasks = (('search', (spec['search_index'], tuple(sorted(spec['search_params'].items()))), spec)
+                 for spec in specs)
+        return self._run(tasks)
+
+    def close(self):
+        ''' Stop the worker processes and the manager '''
+        if self._pool != None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._manager != None:
+            self._manager.shutdown()
+            self._manager = None
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+'''
+    Export parsed items as tables.
+
+    Turning responses into rows by calling get_title, get_authors and so on
+    for every item does an accessor call, and for the DOM parser a search of
+    the Item, per field per item.  The AwsItem of parse_response already has
+    every field so here each row is taken from it with one attrgetter call
+    and written straight out, a row at a time, so any number of items can be
+    exported without holding them:
+
+        writer = AwsCsvWriter(open('dvds.csv', 'wb'))
+        writer.write(search.iter_search('DVD', {'Keywords': 'noir'}))
+
+    AwsJsonLinesWriter writes a JSON object per item instead and
+    numpy_columns builds a NumPy structured array of the numeric fields,
+    if numpy is installed.
+
+    Columns are AwsItem fields plus a few worked out from them, see
+    derived_columns.  running_time and number_of_pages are given as ints
+    and lists are joined by the separator in CSV.
+'''
+import collections
+import csv
+import json
+import operator
+import re
+from aws_item import AwsItem
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class AwsExportException(Exception):
+    '''
+        Exception type raised by AWS export code
+    '''
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+# Columns written if none are given
+default_columns = ('asin', 'title', 'authors', 'actors', 'directors', 'creators', 'genres',
+                   'binding', 'product_group', 'format', 'audience_rating', 'publication_date',
+                   'release_date', 'running_time', 'number_of_pages', 'list_price',
+                   'lowest_new_price', 'detail_page_url', 'medium_image_url')
+
+_leading_int = re.compile(r'\s*(-?\d+)')
+
+def _int(value):
+    ''' The number value starts with, like RunningTime, or None '''
+    if value == None:
+        return None
+    if isinstance(value, (int, long)):
+        return value
+    match = _leading_int.match(value)
+    if match == None:
+        return None
+    return int(match.group(1))
+
+def _year(date):
+    ''' The year of a date like 2008-01-31 or None '''
+    if not date:
+        return None
+    return _int(date[:4])
+
+# Columns that aren't a field of their own but are worked out from one
+derived_columns = {
+        'release_year': ('release_date', _year),
+        'publication_year': ('publication_date', _year)}
+
+# Fields that are kept as text but exported as numbers
+converted_columns = {'running_time': _int, 'number_of_pages': _int}
+
+# Columns numpy_columns can build and the dtype of each.  Missing values
+# are -1.
+numeric_columns = {
+        'number_of_pages': 'i4', 'running_time': 'i4', 'release_year': 'i2',
+        'publication_year': 'i2', 'list_price': 'i8', 'lowest_new_price': 'i8'}
+
+def _fields(columns):
+    ''' The AwsItem field each column comes from and the conversion of it '''
+    fields = []
+    for column in columns:
+        if column in derived_columns:
+            fields.append(derived_columns[column])
+        elif column in AwsItem.__slots__:
+            fields.append((column, converted_columns.get(column)))
+        else:
+            raise AwsExportException("Unknown column '%s'" % column)
+    return fields
+
+def column_fields(columns):
+    ''' The AwsItem fields the columns are made from, for asking for just
+        those with the fields argument of AwsSearch '''
+    return [field for field, convert in _fields(columns)]
+
+def row_getter(columns):
+    '''
+        Function that gives the tuple of the values of the columns for an
+        AwsItem.  The fields are all fetched by one attrgetter and only
+        those that need it are converted.
+    '''
+    fields = _fields(columns)
+    getter = operator.attrgetter(*[field for field, convert in fields])
+    conversions = [(i, convert) for i, (field, convert) in enumerate(fields) if convert != None]
+    if len(fields) == 1:
+        single = getter
+        getter = lambda item: (single(item),)
+    if not conversions:
+        return getter
+    def row(item):
+        values = list(getter(item))
+        for i, convert in conversions:
+            values[i] = convert(values[i])
+        return values
+    return row
+
+def iter_items(source):
+    '''
+        Generator of the AwsItems of source, which may have AwsItems, such as
+        what iter_search gives, or AwsResponses or both.
+    '''
+    for entry in source:
+        if isinstance(entry, AwsItem):
+            yield entry
+        elif entry != None:
+            for item in entry:
+                yield item
+
+class AwsCsvWriter(object):
+    '''
+        Writes items as CSV rows to the file f, which should be opened in
+        binary mode as the csv module wants.  Text is UTF-8 encoded, lists
+        are joined by separator, the (Source, Content) of editorial_reviews
+        as Source: Content, and missing values are empty.  The header
+        row is written before the first row unless header is False.
+        dialect and any other keywords are given to csv.writer.
+    '''
+    def __init__(self, f, columns=default_columns, separator='; ', header=True, **kwargs):
+        self.columns = tuple(columns)
+        self.separator = separator
+        self.count = 0
+        self._row = row_getter(self.columns)
+        self._writer = csv.writer(f, **kwargs)
+        self._header = header
+
+    def _part(self, value):
+        ''' One value of a list.  A tuple, like the (Source, Content) of
+            editorial_reviews, is written as Source: Content. '''
+        if isinstance(value, tuple):
+            return ': '.join([part for part in value if part != None])
+        return value
+
+    def _cell(self, value):
+        if value == None:
+            return ''
+        if isinstance(value, list):
+            value = self.separator.join([self._part(part) for part in value])
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    def write(self, source):
+        ''' Write a row for each item of source, see iter_items.  Returns the
+            number written. '''
+        if self._header:
+            self._writer.writerow(self.columns)
+            self._header = False
+        row = self._row
+        cell = self._cell
+        writerow = self._writer.writerow
+        count = 0
+        for item in iter_items(source):
+            writerow([cell(value) for value in row(item)])
+            count += 1
+        self.count += count
+        return count
+
+class AwsJsonLinesWriter(object):
+    '''
+        Writes each item as a JSON object on a line of its own to the file f,
+        with the keys in the order of the columns.  Lists stay lists and
+        missing values are null.
+    '''
+    def __init__(self, f, columns=default_columns):
+        self.columns = tuple(columns)
+        self.count = 0
+        self._row = row_getter(self.columns)
+        self._f = f
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def write(self, source):
+        ''' Write a line for each item of source, see iter_items.  Returns the
+            number written. '''
+        columns = self.columns
+        row = self._row
+        encode = self._encoder.encode
+        write = self._f.write
+        count = 0
+        for item in iter_items(source):
+            line = encode(collections.OrderedDict(zip(columns, row(item))))
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            write(line + '\n')
+            count += 1
+        self.count += count
+        return count
+
+def numpy_columns(source, columns=None):
+    '''
+        NumPy structured array of the numeric columns of the items of source,
+        see iter_items, with a field for each and the ASIN as its first
+        field.  columns defaults to all of numeric_columns.  The values of
+        each column are gathered as a list and made into an array in one go
+        rather than item by item.
+    '''
+    if numpy == None:
+        raise AwsExportException("numpy_columns needs numpy.  Please install it")
+    if columns == None:
+        columns = sorted(numeric_columns)
+    for column in columns:
+        if column not in numeric_columns:
+            raise AwsExportException("'%s' is not a numeric column" % column)
+    row = row_getter(('asin',) + tuple(columns))
+    values = [[] for column in range(len(columns) + 1)]
+    for item in iter_items(source):
+        for i, value in enumerate(row(item)):
+            values[i].append(value)
+    dtype = [('asin', 'S10')] + [(column, numeric_columns[column]) for column in columns]
+    array = numpy.empty(len(values[0]), dtype=dtype)
+    array['asin'] = values[0]
+    for i, column in enumerate(columns):
+        array[column] = [-1 if value == None else value for value in values[i + 1]]
+    return array
@@ -0,0 +1,247 @@
+#! /usr/bin/env python
+'''
+    Tell which stored items have changed since they were last refreshed.
+
+    Refreshing the ASINs kept in a database mostly gets back items that
+    haven't changed at all, yet every field of every one would be written
+    again.  fingerprint hashes the parts of an AwsItem that matter, its
+    title, prices, images, binding and reviews, each normalized first so
+    that only real changes count.  AwsFingerprintStore keeps the last
+    fingerprint of each ASIN, and refresh looks the ASINs up and reports
+    only those whose fingerprint differs, and in what.  The items of
+    those are the ones fingerprinted, looked up with full_group, so they
+    can be saved as they are:
+
+        store = AwsFingerprintStore('fingerprints.dat')
+        result = refresh(search, asins, store)
+        for asin, parts in result.changed.iteritems():
+            save(result.items[asin])
+        store.save()
+
+    Each fingerprint is a CRC32 of each part so a store takes 30 bytes an
+    ASIN, in memory as well as on disk.
+'''
+import os
+import struct
+import zlib
+from aws_item import AwsItem
+
+class AwsFingerprintException(Exception):
+    '''
+        Exception type raised by AWS fingerprint code
+    '''
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+# The parts of an item that are fingerprinted and the AwsItem fields of each
+fingerprint_parts = (
+        ('title', ('title',)),
+        ('price', ('list_price', 'lowest_new_price')),
+        ('images', ('small_image_url', 'medium_image_url', 'large_image_url')),
+        ('binding', ('binding',)),
+        ('reviews', ('editorial_reviews',)))
+
+# The fields to ask for when looking items up to fingerprint them
+fingerprint_fields = tuple([field for part, fields in fingerprint_parts for field in fields])
+
+# The ResponseGroup refresh asks for by default.  It has all of the
+# fingerprinted fields, OfferSummary for the lowest new price, and all
+# the rest of AwsItem so the changed items can be saved as they are.
+full_group = 'Images,ItemAttributes,EditorialReview,OfferSummary'
+
+_packer = struct.Struct('>%dI' % len(fingerprint_parts))
+asin_size = 10
+record_size = asin_size + _packer.size
+
+def _normalize(value):
+    ''' The value as UTF-8 with runs of whitespace made one space.  Lists
+        and tuples are joined by the unit separator. '''
+    if value == None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return '\x1f'.join([_normalize(v) for v in value])
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return ' '.join(value.split())
+
+def fingerprint(item):
+    ''' Tuple of the CRC32 of each of the fingerprint_parts of an AwsItem '''
+    return tuple([zlib.crc32('\x1e'.join([_normalize(getattr(item, field)) for field in fields])) & 0xffffffff
+                  for part, fields in fingerprint_parts])
+
+def changed_parts(old, new):
+    ''' Names of the parts that differ between two fingerprints '''
+    return [part for (part, fields), a, b in zip(fingerprint_parts, old, new) if a != b]
+
+class AwsFingerprintStore(object):
+    '''
+        The last fingerprint of each ASIN.  They are kept as one string of
+        fixed size records sorted by ASIN, found by binary search, plus a
+        dictionary of the ones put since the last save.  save merges the
+        two and writes them to path, if given, in the same form.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self._records = ''
+        self._puts = {}
+        if path != None and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        f = open(path, 'rb')
+        try:
+            records = f.read()
+        finally:
+            f.close()
+        if len(records) % record_size != 0:
+            raise AwsFingerprintException("%s is not a fingerprint file" % path)
+        self._records = records
+        self._puts = {}
+
+    def _find(self, asin):
+        ''' Position of the record of asin in _records or -1 '''
+        records = self._records
+        lo = 0
+        hi = len(records) // record_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key = records[mid * record_size:mid * record_size + asin_size]
+            if key < asin:
+                lo = mid + 1
+            elif key > asin:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def get(self, asin):
+        ''' The fingerprint of asin or None if there isn't one '''
+        packed = self._puts.get(asin)
+        if packed == None:
+            position = self._find(asin)
+            if position < 0:
+                return None
+            start = position * record_size + asin_size
+            packed = self._records[start:start + _packer.size]
+        return _packer.unpack(packed)
+
+    def put(self, asin, fingerprint):
+        if len(asin) != asin_size:
+            raise AwsFingerprintException("'%s' is not a %d character ASIN" % (asin, asin_size))
+        self._puts[str(asin)] = _packer.pack(*fingerprint)
+
+    def __len__(self):
+        count = len(self._records) // record_size
+        for asin in self._puts:
+            if self._find(asin) < 0:
+                count += 1
+        return count
+
+    def __contains__(self, asin):
+        return asin in self._puts or self._find(asin) >= 0
+
+    def _merged(self):
+        ''' The records with the puts merged in, in order '''
+        records = self._records
+        total = len(records) // record_size
+        parts = []
+        i = 0
+        for asin in sorted(self._puts):
+            while i < total and records[i * record_size:i * record_size + asin_size] < asin:
+                parts.append(records[i * record_size:(i + 1) * record_size])
+                i += 1
+            if i < total and records[i * record_size:i * record_size + asin_size] == asin:
+                i += 1
+            parts.append(asin + self._puts[asin])
+        parts.append(records[i * record_size:])
+        return ''.join(parts)
+
+    def save(self, path=None):
+        ''' Merge the puts into the records and write them to path, or the
+            path of the store, by way of a temporary file '''
+        self._records = self._merged()
+        self._puts = {}
+        path = path or self.path
+        if path == None:
+            return
+        temp = path + '.tmp'
+        f = open(temp, 'wb')
+        try:
+            f.write(self._records)
+        finally:
+            f.close()
+        os.rename(temp, path)
+
+class AwsRefreshResult(object):
+    '''
+        What refresh found.
+
+            changed     Dictionary of each ASIN that changed to the list of
+                        the names of the parts that did, or ['new'] for an
+                        ASIN that had no fingerprint yet
+            items       Dictionary of each changed ASIN to its AwsItem,
+                        with what the group given to refresh has
+            unchanged   Number of ASINs that hadn't changed
+            errors      Dictionary of the ASINs that couldn't be looked up
+                        to the error code, as for AwsLookupResult
+    '''
+    def __init__(self):
+        self.changed = {}
+        self.items = {}
+        self.unchanged = 0
+        self.errors = {}
+
+    def __repr__(self):
+        return '<AwsRefreshResult changed=%d unchanged=%d errors=%d>' % (
+                len(self.changed), self.unchanged, len(self.errors))
+
+def missing_fields(group):
+    ''' The fingerprinted fields that the comma separated ResponseGroups
+        don't have '''
+    groups = set(group.split(','))
+    return [field for field in fingerprint_fields
+            if AwsItem.field_groups[field] and not groups.intersection(AwsItem.field_groups[field])]
+
+def refresh(search, asins, store, update=True, group=full_group):
+    '''
+        Look up the ASINs with AwsSearch.lookup_many and compare the
+        fingerprint of each with the one in the store.  The ResponseGroup
+        group must have every fingerprinted field and the items of the
+        changed ASINs are the same ones that were fingerprinted, so they
+        have whatever else group has too.  If group is None just the
+        fingerprinted fields are asked for, with the cheapest group that
+        has them.  Each ASIN is looked up only once either way.
+
+        Returns an AwsRefreshResult.  Unless update is False the new
+        fingerprints are put in the store, which still has to be saved.
+    '''
+    fields = None
+    if group == None:
+        fields = fingerprint_fields
+    else:
+        missing = missing_fields(group)
+        if missing:
+            raise AwsFingerprintException("ResponseGroup %s doesn't have %s" % (group, ', '.join(missing)))
+    result = AwsRefreshResult()
+    found = search.lookup_many(asins, group, fields)
+    result.errors = dict(found.errors)
+    for asin, item in found.iteritems():
+        if item == None:
+            continue
+        new = fingerprint(item)
+        old = store.get(asin)
+        if old == new:
+            result.unchanged += 1
+            continue
+        if old == None:
+            result.changed[asin] = ['new']
+        else:
+            result.changed[asin] = changed_parts(old, new)
+        result.items[asin] = item
+        if update:
+            store.put(asin, new)
+    return result
@@ -0,0 +1,217 @@
+#! /usr/bin/env python
+'''
+    Generated ItemSearch, ItemLookup and BrowseNodeLookup responses.
+
+    The responses are made up but have the same structure, namespace and
+    kinds of values as real ones, including long EditorialReviews full of
+    escaped HTML, so parsing them costs about what parsing Amazon's does.
+    The same arguments always give the same response.  They are served by
+    aws_mock and are the fixtures of the benchmarks.
+'''
+import random
+from xml.sax.saxutils import escape
+
+namespace = 'http://webservices.amazon.com/AWSECommerceService/2011-08-01'
+
+_words = ('the', 'a', 'of', 'film', 'story', 'classic', 'science', 'fiction', 'director',
+          'cut', 'final', 'edition', 'android', 'replicant', 'future', 'city', 'rain',
+          'noir', 'memory', 'human', 'light', 'dream', 'electric', 'sheep')
+_people = ('Harrison Ford', 'Rutger Hauer', 'Sean Young', 'Edward James Olmos',
+           'Ridley Scott', 'Philip K. Dick', 'Hampton Fancher', 'David Peoples',
+           'Michael Deeley', 'Daryl Hannah')
+_bindings = ('DVD', 'Blu-ray', 'Amazon Instant Video', 'Paperback', 'Hardcover', 'Kindle Edition')
+_genres = ('Science Fiction', 'Drama', 'Thriller', 'Classics')
+
+def asin(i):
+    ''' The ASIN of the i'th generated item '''
+    return 'B%09d' % (i + 1)
+
+def error_xml(operation, code, message):
+    ''' The error response Amazon sends for a whole request, such as
+        RequestThrottled or SignatureDoesNotMatch '''
+    return ('<?xml version="1.0" ?>\n<%sErrorResponse xmlns="%s"><Error><Code>%s</Code>'
+            '<Message>%s</Message></Error><RequestID>5c4f2d7a-0000-0000-0000-000000000000</RequestID>'
+            '</%sErrorResponse>' % (operation, namespace, code, escape(message), operation))
+
+def _errors_xml(errors):
+    ''' The <Errors> block of a Request with errors '''
+    if not errors:
+        return ''
+    return '<Errors>%s</Errors>' % ''.join(['<Error><Code>%s</Code><Message>%s</Message></Error>'
+                                            % (code, escape(message)) for code, message in errors])
+
+def _text(rng, length):
+    ''' Review text with HTML markup, which ends up escaped in the XML '''
+    words = []
+    size = 0
+    while size < length:
+        w = rng.choice(_words)
+        if rng.random() < 0.05:
+            w = '<b>%s</b>' % w
+        elif rng.random() < 0.03:
+            w = w + '.<br /><br />'
+        words.append(w)
+        size += len(w) + 1
+    return ' '.join(words)
+
+# What each ResponseGroup has in an Item.  Small only has some ItemAttributes.
+group_parts = {
+    'Small': set(['Small']), 'ItemAttributes': set(['Small', 'ItemAttributes']),
+    'Images': set(['Images']), 'EditorialReview': set(['EditorialReview']),
+    'OfferSummary': set(['OfferSummary']),
+    'Medium': set(['Small', 'ItemAttributes', 'Images', 'EditorialReview', 'OfferSummary']),
+    'Large': set(['Small', 'ItemAttributes', 'Images', 'EditorialReview', 'OfferSummary'])}
+
+default_groups = 'Images,ItemAttributes,EditorialReview'
+
+def _parts(groups):
+    parts = set()
+    for group in groups.split(','):
+        parts.update(group_parts.get(group, ()))
+    return parts
+
+def item_xml(rng, item_asin, i, review_size, groups=default_groups):
+    ''' One <Item> with what the comma separated ResponseGroups have.  i
+        only varies the numbers in it. '''
+    wanted = _parts(groups)
+    title = ' '.join(rng.choice(_words) for n in range(4)).title()
+    binding = rng.choice(_bindings)
+    actors = rng.sample(_people, 3)
+    creator = rng.choice(_people)
+    director = rng.choice(_people)
+    genre = rng.choice(_genres)
+    description = _text(rng, review_size / 4)
+    review = _text(rng, review_size)
+
+    parts = ['<Item><ASIN>%s</ASIN>' % item_asin]
+    if 'Small' in wanted:
+        parts.append('<DetailPageURL>http://www.amazon.com/dp/%s?tag=bench-20&amp;linkCode=xm2</DetailPageURL>' % item_asin)
+    if 'Images' in wanted:
+        for size, height in (('SmallImage', 75), ('MediumImage', 160), ('LargeImage', 500)):
+            parts.append('<%s><URL>http://ecx.images-amazon.com/images/I/%s.%s.jpg</URL>'
+                         '<Height Units="pixels">%d</Height><Width Units="pixels">%d</Width></%s>'
+                         % (size, item_asin, size, height, height * 3 / 4, size))
+        parts.append('<ImageSets><ImageSet Category="primary"><SwatchImage><URL>http://ecx.images-amazon.com/images/I/%s.sw.jpg</URL></SwatchImage></ImageSet></ImageSets>' % item_asin)
+    if 'Small' in wanted:
+        full = 'ItemAttributes' in wanted
+        parts.append('<ItemAttributes>')
+        for actor in actors:
+            parts.append('<Actor>%s</Actor>' % actor)
+        if full:
+            parts.append('<AudienceRating>R (Restricted)</AudienceRating>')
+            parts.append('<Binding>%s</Binding>' % binding)
+        parts.append('<Creator Role="Producer">%s</Creator>' % creator)
+        parts.append('<Director>%s</Director>' % director)
+        if full:
+            parts.append('<Format>Widescreen</Format>')
+            parts.append('<Genre>%s</Genre>' % genre)
+            parts.append('<ListPrice><Amount>%d</Amount><CurrencyCode>USD</CurrencyCode>'
+                         '<FormattedPrice>$%.2f</FormattedPrice></ListPrice>' % ((i + 5) * 100 - 1, (i + 5) - 0.01))
+            parts.append('<NumberOfPages>%d</NumberOfPages>' % (100 + i))
+        parts.append('<ProductGroup>%s</ProductGroup>' % ('Book' if binding in ('Paperback', 'Hardcover') else 'Movie'))
+        if full:
+            parts.append('<PublicationDate>2007-12-%02d</PublicationDate>' % (i % 28 + 1))
+            parts.append('<ReleaseDate>2008-01-%02d</ReleaseDate>' % (i % 28 + 1))
+            parts.append('<RunningTime Units="minutes">%d</RunningTime>' % (90 + i % 60))
+            parts.append('<Studio>Warner Bros.</Studio>')
+        parts.append('<Title>%s</Title>' % escape(title))
+        parts.append('</ItemAttributes>')
+    if 'OfferSummary' in wanted:
+        price = (i + 5) * 80 - 1
+        parts.append('<OfferSummary><LowestNewPrice><Amount>%d</Amount><CurrencyCode>USD</CurrencyCode>'
+                     '<FormattedPrice>$%.2f</FormattedPrice></LowestNewPrice><TotalNew>%d</TotalNew>'
+                     '</OfferSummary>' % (price, price / 100.0, 1 + i % 7))
+    if 'EditorialReview' in wanted:
+        parts.append('<EditorialReviews>')
+        parts.append('<EditorialReview><Source>Product Description</Source><Content>%s</Content>'
+                     '<IsLinkSuppressed>0</IsLinkSuppressed></EditorialReview>' % escape(description))
+        parts.append('<EditorialReview><Source>Amazon.com</Source><Content>%s</Content>'
+                     '<IsLinkSuppressed>0</IsLinkSuppressed></EditorialReview>' % escape(review))
+        parts.append('</EditorialReviews>')
+    parts.append('</Item>')
+    return ''.join(parts)
+
+def response_xml(operation, count, review_size, seed=1, asins=None, total_pages=None, errors=(),
+                    groups=default_groups):
+    '''
+        A whole ItemSearch or ItemLookup response.  It has count items with
+        the ASINs from asin(i) unless the list of asins is given.  The
+        TotalPages of an ItemSearch is count unless given.  errors is a list
+        of (Code, Message) for an <Errors> block in the Request.  The items
+        have what the ResponseGroups in groups would have.
+    '''
+    rng = random.Random(seed)
+    if asins == None:
+        asins = [asin(i) for i in range(count)]
+    parts = ['<?xml version="1.0" ?>\n<%sResponse xmlns="%s">' % (operation, namespace),
+             '<OperationRequest><HTTPHeaders><Header Name="UserAgent" Value="python"/></HTTPHeaders>'
+             '<RequestId>5c4f2d7a-0000-0000-0000-000000000000</RequestId>'
+             '<Arguments><Argument Name="Operation" Value="%s"/></Arguments>'
+             '<RequestProcessingTime>0.0512</RequestProcessingTime></OperationRequest>' % operation,
+             '<Items><Request><IsValid>True</IsValid>%s</Request>' % _errors_xml(errors)]
+    if operation == 'ItemSearch':
+        if total_pages == None:
+            total_pages = max(1, len(asins))
+        parts.append('<TotalResults>%d</TotalResults><TotalPages>%d</TotalPages>'
+                     % (total_pages * 10, total_pages))
+    for i, item_asin in enumerate(asins):
+        parts.append(item_xml(rng, item_asin, i, review_size, groups))
+    parts.append('</Items></%sResponse>' % operation)
+    return '\n'.join(parts)
+
+def browse_node_children(node_id, depth=4, seed=0):
+    '''
+        BrowseNodeIds of the children of a generated browse node.  The roots
+        are 1 to 9 and each node n has up to 4 children numbered from n*10+1,
+        so the digits of an id are its path from the root.  Nodes depth
+        levels below a root have none.  seed changes which children there
+        are, as if the catalogue had changed.
+    '''
+    if node_id >= 10 ** depth:
+        return []
+    count = random.Random(node_id * 1000 + seed).randint(0, 4)
+    return [node_id * 10 + i for i in range(1, count + 1)]
+
+def browse_node_name(node_id):
+    rng = random.Random(node_id)
+    return ' '.join(rng.choice(_words) for n in range(2)).title()
+
+def browse_node_xml(node_id, depth=4, seed=0):
+    ''' One <BrowseNode> with its Children and nested Ancestors '''
+    parts = ['<BrowseNode><BrowseNodeId>%d</BrowseNodeId><Name>%s</Name>'
+             % (node_id, escape(browse_node_name(node_id)))]
+    if node_id < 10:
+        parts.append('<IsCategoryRoot>1</IsCategoryRoot>')
+    children = browse_node_children(node_id, depth, seed)
+    if children:
+        parts.append('<Children>')
+        for child in children:
+            parts.append('<BrowseNode><BrowseNodeId>%d</BrowseNodeId><Name>%s</Name></BrowseNode>'
+                         % (child, escape(browse_node_name(child))))
+        parts.append('</Children>')
+    ancestors = []
+    parent = node_id // 10
+    while parent > 0:
+        ancestors.append(parent)
+        parent = parent // 10
+    for ancestor in ancestors:
+        parts.append('<Ancestors><BrowseNode><BrowseNodeId>%d</BrowseNodeId><Name>%s</Name>'
+                     % (ancestor, escape(browse_node_name(ancestor))))
+    parts.append('</BrowseNode></Ancestors>' * len(ancestors))
+    parts.append('</BrowseNode>')
+    return ''.join(parts)
+
+def browse_nodes_xml(node_ids, depth=4, seed=0, errors=()):
+    ''' A whole BrowseNodeLookup response for the node_ids '''
+    parts = ['<?xml version="1.0" ?>\n<BrowseNodeLookupResponse xmlns="%s">' % namespace,
+             '<OperationRequest><RequestId>5c4f2d7a-0000-0000-0000-000000000000</RequestId>'
+             '<Arguments><Argument Name="Operation" Value="BrowseNodeLookup"/></Arguments>'
+             '<RequestProcessingTime>0.0121</RequestProcessingTime></OperationRequest>',
+             '<BrowseNodes><Request><IsValid>True</IsValid><BrowseNodeLookupRequest>%s'
+             '<ResponseGroup>BrowseNodeInfo</ResponseGroup></BrowseNodeLookupRequest>%s</Request>'
+             % (''.join(['<BrowseNodeId>%d</BrowseNodeId>' % node_id for node_id in node_ids]),
+                _errors_xml(errors))]
+    for node_id in node_ids:
+        parts.append(browse_node_xml(node_id, depth, seed))
+    parts.append('</BrowseNodes></BrowseNodeLookupResponse>')
+    return '\n'.join(parts)
@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+'''
+    Coalescing of identical requests that are in flight at the same time.
+
+    When several threads ask for the same popular ASIN at once each would
+    sign and send its own request and each one counts against the rate
+    limit.  With AwsSingleFlight only the first of them, the leader, sends
+    the request and the others wait for it and get the same parsed response.
+    Requests are identical if their canonical queries are, the same key
+    the cache uses.
+
+    AwsSearch uses it from threads through call and AsyncAwsSearch uses
+    begin and finish from its event loop so both share one flight.
+'''
+import threading
+
+class AwsSingleFlight(object):
+    '''
+        Requests in flight by key with the callbacks of everybody waiting on
+        them.  shared counts the requests that weren't sent because an
+        identical one already was.
+    '''
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def begin(self, key, callback):
+        '''
+            True if there is no request in flight for key, in which case the
+            caller is the leader and must call finish when it is done.
+            Otherwise callback(result, exception) is called, from whichever
+            thread the leader finishes in, with its result.
+        '''
+        with self._lock:
+            waiters = self._calls.get(key)
+            if waiters == None:
+                self._calls[key] = []
+                return True
+            waiters.append(callback)
+            self.shared += 1
+            return False
+
+    def finish(self, key, result, exception=None):
+        ''' The leader for key is done so pass the result to the others '''
+        with self._lock:
+            waiters = self._calls.pop(key, [])
+        for callback in waiters:
+            callback(result, exception)
+
+    def call(self, key, fn):
+        '''
+            Return fn() unless an identical request is already in flight in
+            which case wait for and return its result instead.  An exception
+            raised by fn, even KeyboardInterrupt or SystemExit, is raised in
+            every waiting thread too so none of them is left waiting.
+        '''
+        done = threading.Event()
+        outcome = []
+        def wait(result, exception):
+            outcome.append((result, exception))
+            done.set()
+        if self.begin(key, wait):
+            try:
+                result = fn()
+            except BaseException as e:
+                self.finish(key, None, e)
+                raise
+            self.finish(key, result)
+            return result
+        done.wait()
+        result, exception = outcome[0]
+        if exception != None:
+            raise exception
+        return result
+
+    def in_flight(self):
+        ''' Number of distinct requests in flight '''
+        with self._lock:
+            return len(self._calls)
+
+_default_flight = None
+_default_flight_lock = threading.Lock()
+
+def default_flight():
+    ''' The AwsSingleFlight shared by every AwsSearch not given its own '''
+    global _default_flight
+    with _default_flight_lock:
+        if _default_flight == None:
+            _default_flight = AwsSingleFlight()
+        return _default_flight
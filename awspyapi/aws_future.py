@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+'''
+    AwsFuture, the result of a request that hasn't finished yet, as
+    returned by AsyncAwsSearch and LookupBatcher.
+'''
+import threading
+from aws_http import AwsHttpException
+
+class AwsFuture(object):
+    '''
+        The eventual result of a request.  It is thread safe so the result can
+        be waited for from a thread other than the one that sets it.
+    '''
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        ''' Wait for and return the result or raise the exception if it failed '''
+        self._wait(timeout)
+        if self._exception != None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        ''' Wait for and return the exception or None if it succeeded '''
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        ''' Call fn(future) when done or right away if it already is '''
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise AwsHttpException("Timed out waiting for result")
+
+    def _finish(self, result, exception):
+        with self._cond:
+            if self._done:
+                return
+            self._result = result
+            self._exception = exception
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._cond.notify_all()
+        for fn in callbacks:
+            fn(self)
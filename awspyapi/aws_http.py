@@ -0,0 +1,263 @@
+#! /usr/bin/env python
+'''
+    Keep-alive HTTP transport for the Product Advertising API.
+
+    urlopen makes a new connection for every request which is a lot of the
+    time taken by a lookup.  AwsConnectionPool keeps the connections to each
+    host open after a request is done and hands them out again for the next
+    one.  It is thread safe so one pool can be shared by any number of
+    AwsSearch objects.
+
+    The responses are mostly repetitive XML so it also asks for them gzip or
+    deflate compressed and decompresses them a piece at a time as the parser
+    reads them, so the whole body is never held compressed and uncompressed.
+'''
+import httplib
+import socket
+import threading
+import time
+import urlparse
+import zlib
+
+# What to send as Accept-Encoding when compression is wanted
+accept_encoding = 'gzip, deflate'
+
+class AwsDecoder(object):
+    '''
+        Incremental decompression of a Content-Encoding of gzip or deflate.
+        Deflate should be zlib wrapped but some servers send it raw, so which
+        it is is decided from the first two bytes.
+    '''
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._decompressor = None
+        self._start = ''
+        if encoding in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        if self._decompressor == None:
+            data = self._start + data
+            if len(data) < 2:
+                self._start = data
+                return ''
+            if (ord(data[0]) & 0x0f) == 8 and ((ord(data[0]) << 8) + ord(data[1])) % 31 == 0:
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+            else:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error as e:
+            raise AwsHttpException("Bad %s response body: %s" % (self.encoding, str(e)))
+
+    def flush(self):
+        if self._decompressor == None:
+            return ''
+        return self._decompressor.flush()
+
+def decoder_for(content_encoding):
+    ''' An AwsDecoder for the Content-Encoding header or None if the body
+        isn't compressed '''
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        return AwsDecoder(encoding)
+    if encoding in ('', 'identity'):
+        return None
+    raise AwsHttpException("Unsupported Content-Encoding '%s'" % encoding)
+
+class AwsHttpException(Exception):
+    '''
+        Exception type raised by AWS HTTP transport code
+    '''
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class AwsPooledResponse(object):
+    '''
+        File like wrapper around an httplib response that gives the connection
+        back to the pool once the whole body has been read and the response is
+        closed.  That is what parse and parse_response expect to be given.
+        A compressed body is decompressed as it is read.  bytes_read is the
+        size of the body read so far as it came over the wire, bytes_decoded
+        its size once decompressed and read_time the seconds spent reading
+        and decompressing it.  connect_time is the seconds taken to
+        connect, or None if a pooled connection was used, and ttfb the
+        seconds from sending the request to having the response headers.
+    '''
+    def __init__(self, pool, key, conn, response, connect_time=None, ttfb=None):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+        self.read_time = 0.0
+        self.connect_time = connect_time
+        self.ttfb = ttfb
+        self.decoder = decoder_for(response.getheader('content-encoding'))
+
+    def read(self, amt=None):
+        ''' Up to amt bytes of the body, or all of it.  A compressed body may
+            give back somewhat more than amt. '''
+        if self.response == None:
+            return ''
+        start = time.time()
+        data = self.response.read(amt)
+        self.bytes_read += len(data)
+        if self.decoder != None:
+            ''' Keep reading until there's something to return as '' would
+                look like the end '''
+            raw = data
+            data = self.decoder.decompress(raw)
+            while not data and raw:
+                raw = self.response.read(amt)
+                self.bytes_read += len(raw)
+                data = self.decoder.decompress(raw)
+            if not raw or amt == None:
+                data += self.decoder.flush()
+                self.decoder = None
+        self.read_time += time.time() - start
+        self.bytes_decoded += len(data)
+        return data
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def close(self):
+        ''' Give the connection back if the body was all read and the server
+            will keep it open.  Otherwise there's no way to reuse it. '''
+        if self.response == None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool._release(self.key, self.conn)
+        else:
+            self.response.close()
+            self.conn.close()
+        self.response = None
+        self.conn = None
+
+class AwsConnectionPool(object):
+    '''
+        Pool of keep-alive httplib connections for each scheme and host.
+
+            pool_size       Most idle connections kept open for each host.
+                            More than that may be in use at once but the
+                            extras are closed when they're done.
+            idle_timeout    Seconds a connection may sit idle before it is
+                            assumed the server has closed it and it is
+                            thrown away instead of reused
+            timeout         Socket timeout in seconds for each request
+            compress        Ask for the responses to be compressed
+    '''
+    def __init__(self, pool_size=4, idle_timeout=15.0, timeout=10.0, compress=True):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.compress = compress
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        elif scheme == 'http':
+            return httplib.HTTPConnection(netloc, timeout=self.timeout)
+        raise AwsHttpException("Unsupported URL scheme '%s'" % scheme)
+
+    def _get(self, key):
+        ''' An idle connection to the host or None if there isn't one '''
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return conn
+                conn.close()
+        return None
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def urlopen(self, url, headers={}):
+        '''
+            GET the url using a pooled connection and return an AwsPooledResponse
+            which, just like what urllib2.urlopen returns, should be closed when
+            done with it.
+
+            Amazon returns its errors as XML even along with an HTTP error status
+            so those are returned too for the caller to parse.  Any other failure
+            raises AwsHttpException.
+        '''
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        key = (scheme, netloc)
+        if query:
+            path = path + '?' + query
+        if self.compress and 'Accept-Encoding' not in headers:
+            headers = dict(headers)
+            headers['Accept-Encoding'] = accept_encoding
+
+        conn = self._get(key)
+        reused = conn != None
+        while True:
+            connect_time = None
+            if conn == None:
+                conn = self._new_connection(key)
+            try:
+                if conn.sock == None:
+                    start = time.time()
+                    conn.connect()
+                    connect_time = time.time() - start
+                start = time.time()
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                ttfb = time.time() - start
+                break
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                conn = None
+                if not reused:
+                    raise AwsHttpException("Request to %s failed: %s" % (netloc, str(e)))
+                ''' Server probably closed the idle connection so try once
+                    more with a new one '''
+                reused = False
+
+        if response.status >= 400 and 'xml' not in response.getheader('content-type', ''):
+            response.close()
+            conn.close()
+            raise AwsHttpException("Request to %s failed: %d %s" % (netloc, response.status, response.reason))
+        try:
+            return AwsPooledResponse(self, key, conn, response, connect_time, ttfb)
+        except AwsHttpException:
+            response.close()
+            conn.close()
+            raise
+
+    def close(self):
+        ''' Close all of the idle connections '''
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, last_used in idle:
+                    conn.close()
+            self._idle = {}
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def default_pool():
+    ''' The AwsConnectionPool shared by every AwsSearch not given its own '''
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool == None:
+            _default_pool = AwsConnectionPool()
+        return _default_pool
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+'''
+    Inverted index of the ItemAttributes of a response.
+
+    get_items_by_attributes used to go through every item and every value of
+    each wanted attribute for every call.  AwsAttributeIndex maps each
+    (attribute, value) to the positions of the items having it so an exact
+    match is a dictionary lookup and set intersection.  Loose matches, where
+    the wanted value only has to be part of the item's value, look up the
+    values having all of its trigrams and only check those.
+
+    AwsResponse.index() builds it the first time it is needed and keeps it
+    so filtering the same results again costs next to nothing.
+'''
+
+class AwsAttributeIndex(object):
+    '''
+        Index of the attributes dictionaries of a list of AwsItem.  match
+        gives the same items, in the same order, as checking each item's
+        attributes would.  The trigrams of an attribute are only worked out
+        the first time it is loosely matched on.
+    '''
+    def __init__(self, items):
+        self.items = list(items)
+        self._values = {}
+        self._trigrams = {}
+        for position, item in enumerate(self.items):
+            for name, values in item.attributes.iteritems():
+                index = self._values.setdefault(name, {})
+                for value in values:
+                    index.setdefault(value, set()).add(position)
+
+    def _attribute_trigrams(self, name):
+        ''' Trigram to the set of values of the attribute containing it '''
+        trigrams = self._trigrams.get(name)
+        if trigrams == None:
+            trigrams = {}
+            for value in self._values.get(name, ()):
+                for i in xrange(len(value) - 2):
+                    trigrams.setdefault(value[i:i+3], set()).add(value)
+            self._trigrams[name] = trigrams
+        return trigrams
+
+    def _loose_values(self, name, wanted):
+        ''' The values of the attribute that contain wanted '''
+        values = self._values.get(name, {})
+        if len(wanted) < 3:
+            return [v for v in values if wanted in v]
+        trigrams = self._attribute_trigrams(name)
+        candidates = None
+        for i in xrange(len(wanted) - 2):
+            found = trigrams.get(wanted[i:i+3])
+            if not found:
+                return []
+            if candidates == None:
+                candidates = set(found)
+            else:
+                candidates &= found
+                if not candidates:
+                    return []
+        return [v for v in candidates if wanted in v]
+
+    def positions(self, name, wanted, loose=True):
+        ''' Set of the positions of the items whose attribute matches wanted '''
+        values = self._values.get(name)
+        if values == None:
+            return set()
+        if not loose:
+            return set(values.get(wanted, ()))
+        matched = set()
+        for value in self._loose_values(name, wanted):
+            matched |= values[value]
+        return matched
+
+    def match(self, attributes, loose=True):
+        ''' List of the items matching all of the attributes, like
+            AwsSearch.get_items_by_attributes '''
+        if not attributes:
+            return list(self.items)
+        ''' Start with the attribute matching fewest items so the
+            intersection shrinks as fast as possible '''
+        sets = sorted([self.positions(k, v, loose) for k, v in attributes.iteritems()], key=len)
+        matched = sets[0]
+        for s in sets[1:]:
+            if not matched:
+                break
+            matched = matched & s
+        return [self.items[p] for p in sorted(matched)]
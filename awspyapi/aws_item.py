@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+'''
+    The AwsItem value class which holds everything extracted from one <Item>
+    of a response.  It is filled in by aws_parse in a single pass over the
+    Item so reading any field afterwards is just an attribute lookup.
+'''
+
+class AwsItem(object):
+    '''
+        One Item from an ItemSearch or ItemLookup.  Single valued ItemAttributes
+        are None if they were not in the response and multi valued ones, like
+        Actor, are empty lists.  Every leaf value of ItemAttributes is also kept
+        in the attributes dictionary, keyed by tag and mapping to a list of values,
+        for anything that does not have a field of its own.
+
+            asin                ASIN
+            detail_page_url     DetailPageURL
+            small_image_url     URL of the SmallImage
+            medium_image_url    URL of the MediumImage
+            large_image_url     URL of the LargeImage
+            title               Title
+            binding             Binding such as Paperback or Blu-ray
+            product_group       ProductGroup such as Book or Movie
+            publication_date    PublicationDate
+            release_date        TheatricalReleaseDate or if not found ReleaseDate
+            running_time        RunningTime (in minutes as far as I have seen)
+            number_of_pages     NumberOfPages
+            audience_rating     AudienceRating, i.e., the MPAA rating
+            format              Format
+            list_price          Amount of the ListPrice in cents as an int
+            lowest_new_price    Amount of the LowestNewPrice of the OfferSummary
+                                in cents as an int
+            authors             List of Author
+            actors              List of Actor
+            directors           List of Director
+            creators            List of Creator
+            genres              List of Genre
+            attributes          Dictionary of all ItemAttributes
+            editorial_reviews   List of (Source, Content) tuples
+            description         Set by AwsSearch.get_amazon_review and
+                                get_product_description for compatibility
+                                with the DOM elements they used to set it on
+    '''
+    __slots__ = ('asin', 'detail_page_url', 'small_image_url', 'medium_image_url',
+                 'large_image_url', 'title', 'binding', 'product_group',
+                 'publication_date', 'release_date', 'running_time', 'number_of_pages',
+                 'audience_rating', 'format', 'list_price', 'lowest_new_price', 'authors', 'actors',
+                 'directors', 'creators', 'genres', 'attributes', 'editorial_reviews',
+                 'description')
+
+    # ItemAttributes tags with a single valued field of their own
+    single_attributes = {
+            'Title': 'title', 'Binding': 'binding', 'ProductGroup': 'product_group',
+            'PublicationDate': 'publication_date', 'RunningTime': 'running_time',
+            'NumberOfPages': 'number_of_pages', 'AudienceRating': 'audience_rating',
+            'Format': 'format'}
+
+    # ItemAttributes tags with a list valued field of their own
+    multi_attributes = {
+            'Author': 'authors', 'Actor': 'actors', 'Director': 'directors',
+            'Creator': 'creators', 'Genre': 'genres'}
+
+    # Image tags and the field holding their URL
+    image_fields = {
+            'SmallImage': 'small_image_url', 'MediumImage': 'medium_image_url',
+            'LargeImage': 'large_image_url'}
+
+    # The fields that may be asked for, each with the ResponseGroups that have
+    # it.  ASIN is in every response.
+    _small = ('Small', 'ItemAttributes', 'Medium', 'Large')
+    _attributes = ('ItemAttributes', 'Medium', 'Large')
+    _images = ('Images', 'Medium', 'Large')
+    _reviews = ('EditorialReview', 'Medium', 'Large')
+    field_groups = {
+            'asin': (), 'detail_page_url': _small,
+            'small_image_url': _images, 'medium_image_url': _images, 'large_image_url': _images,
+            'title': _small, 'authors': _small, 'actors': _small, 'directors': _small,
+            'creators': _small, 'product_group': _small,
+            'binding': _attributes, 'publication_date': _attributes, 'release_date': _attributes,
+            'running_time': _attributes, 'number_of_pages': _attributes,
+            'audience_rating': _attributes, 'format': _attributes, 'list_price': _attributes,
+            'genres': _attributes, 'attributes': _attributes,
+            'editorial_reviews': _reviews, 'description': _reviews,
+            'lowest_new_price': ('OfferSummary', 'Medium', 'Large')}
+
+    # Shorter names that may be used for fields
+    field_aliases = {
+            'small_image': 'small_image_url', 'medium_image': 'medium_image_url',
+            'large_image': 'large_image_url', 'detail_page': 'detail_page_url'}
+
+    # ItemAttributes tags of the fields that don't simply have one
+    field_tags = {
+            'release_date': ('TheatricalReleaseDate', 'ReleaseDate'),
+            'list_price': ('ListPrice',)}
+
+    def __init__(self, asin=None):
+        self.asin = asin
+        self.detail_page_url = None
+        self.small_image_url = None
+        self.medium_image_url = None
+        self.large_image_url = None
+        self.title = None
+        self.binding = None
+        self.product_group = None
+        self.publication_date = None
+        self.release_date = None
+        self.running_time = None
+        self.number_of_pages = None
+        self.audience_rating = None
+        self.format = None
+        self.list_price = None
+        self.lowest_new_price = None
+        self.authors = []
+        self.actors = []
+        self.directors = []
+        self.creators = []
+        self.genres = []
+        self.attributes = {}
+        self.editorial_reviews = []
+        self.description = None
+
+    def get_image_url(self, size='Medium'):
+        ''' URL for the image of the given size, Small, Medium or Large '''
+        return getattr(self, self.image_fields[size+'Image'])
+
+    def get_editorial_review(self, source):
+        ''' Content of the first EditorialReview from source or the empty string '''
+        for s, content in self.editorial_reviews:
+            if s == source and content != None:
+                return content
+        return ''
+
+    def __getstate__(self):
+        ''' The slots as a dictionary, which pickle needs for a class with
+            __slots__ with protocols 0 and 1 '''
+        return dict((name, getattr(self, name)) for name in AwsItem.__slots__)
+
+    def __setstate__(self, state):
+        ''' Protocol 2 pickles from before __getstate__ have (None, slots) '''
+        if isinstance(state, tuple):
+            state = state[1]
+        AwsItem.__init__(self)
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<AwsItem %s %r>' % (self.asin, self.title)
+
+class AwsBrowseNode(object):
+    '''
+        One BrowseNode from a BrowseNodeLookup.
+
+            id                  BrowseNodeId as an int
+            name                Name
+            is_category_root    True if IsCategoryRoot is 1
+            children            List of (BrowseNodeId, Name) of the Children
+            ancestors           List of (BrowseNodeId, Name) of the Ancestors,
+                                the parent first
+    '''
+    __slots__ = ('id', 'name', 'is_category_root', 'children', 'ancestors')
+
+    def __init__(self, id=None, name=None):
+        self.id = id
+        self.name = name
+        self.is_category_root = False
+        self.children = []
+        self.ancestors = []
+
+    def __getstate__(self):
+        ''' The slots as a dictionary, which pickle needs for a class with
+            __slots__ with protocols 0 and 1 '''
+        return dict((name, getattr(self, name)) for name in AwsBrowseNode.__slots__)
+
+    def __setstate__(self, state):
+        ''' Protocol 2 pickles from before __getstate__ have (None, slots) '''
+        if isinstance(state, tuple):
+            state = state[1]
+        AwsBrowseNode.__init__(self)
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<AwsBrowseNode %s %r>' % (self.id, self.name)
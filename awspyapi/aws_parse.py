@@ -0,0 +1,405 @@
+#! /usr/bin/env python
+'''
+    Streaming parser for Product Advertising API responses.
+
+    Rather than building a complete minidom tree for every response this
+    walks the XML with iterparse and keeps only a compact AwsItem for each
+    Item as it goes by.  Each Item element is thrown away as soon as its
+    AwsItem is built so memory stays proportional to the items and not
+    to the size of the response.  The BrowseNodes of a BrowseNodeLookup
+    become AwsBrowseNode the same way.
+
+    parse_lazy instead keeps the bytes of the response and only parses
+    each Item when one of its fields is first asked for.
+'''
+import re
+import time
+from cStringIO import StringIO
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+from aws_item import AwsItem, AwsBrowseNode
+from aws_index import AwsAttributeIndex
+
+class AwsParseException(Exception):
+    '''
+        Exception type raised by AWS response parsing code
+    '''
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class AwsResponse(list):
+    '''
+        The parsed result of an ItemSearch, ItemLookup or BrowseNodeLookup.
+        It is simply a list of AwsItem, or AwsBrowseNode, in the order
+        Amazon returned them with a few extra bits of information about the
+        response itself:
+
+            errors          List of error codes, one for each <Errors> block,
+                            which is the same thing AwsSearch.get_errors
+                            has always returned
+            error_details   List of (Code, Message) for every <Error>
+                            which is needed to tell which ItemId of a
+                            multiple ASIN ItemLookup an error is about
+            total_results   TotalResults if present else None
+            total_pages     TotalPages if present else None
+
+        index() returns the AwsAttributeIndex of the items, made the first
+        time it is asked for.  It isn't pickled along with the response.
+    '''
+    __slots__ = ('errors', 'error_details', 'total_results', 'total_pages', '_index')
+
+    def __init__(self, items=()):
+        list.__init__(self, items)
+        self.errors = []
+        self.error_details = []
+        self.total_results = None
+        self.total_pages = None
+        self._index = None
+
+    def index(self):
+        ''' The AwsAttributeIndex for the items as they are now '''
+        if self._index == None or len(self._index.items) != len(self):
+            self._index = AwsAttributeIndex(self)
+        return self._index
+
+    def __getstate__(self):
+        return (None, {'errors': self.errors, 'error_details': self.error_details,
+                       'total_results': self.total_results, 'total_pages': self.total_pages,
+                       '_index': None})
+
+def _local(tag):
+    ''' Strip the {namespace} that ElementTree puts in front of tag names '''
+    if tag[0] == '{':
+        return tag[tag.index('}')+1:]
+    return tag
+
+def _child_text(elem, name):
+    ''' Text of the first direct child of elem with the given tag or None '''
+    for c in elem:
+        if _local(c.tag) == name:
+            return c.text
+    return None
+
+def _item_attributes(item, elem, tags=None):
+    ''' Fill in the ItemAttributes of item from the <ItemAttributes> element.
+        Every leaf value, including nested ones such as the Amount in ListPrice,
+        goes in the attributes dictionary keyed by its own tag name.  If a set
+        of tags is given only those are looked at.
+    '''
+    attributes = item.attributes
+    single = AwsItem.single_attributes
+    multi = AwsItem.multi_attributes
+    for child in elem:
+        tag = _local(child.tag)
+        if tags != None and tag not in tags:
+            continue
+        if len(child) == 0:
+            if child.text == None:
+                continue
+            attributes.setdefault(tag, []).append(child.text)
+            if tag in single:
+                if getattr(item, single[tag]) == None:
+                    setattr(item, single[tag], child.text)
+            elif tag in multi:
+                getattr(item, multi[tag]).append(child.text)
+        else:
+            if tag == 'ListPrice':
+                amount = _child_text(child, 'Amount')
+                if amount != None and item.list_price == None:
+                    item.list_price = int(amount)
+            for a in child.iter():
+                if len(a) == 0 and a.text != None:
+                    attributes.setdefault(_local(a.tag), []).append(a.text)
+    dates = attributes.get('TheatricalReleaseDate') or attributes.get('ReleaseDate')
+    if dates:
+        item.release_date = dates[0]
+
+class _Wanted(object):
+    '''
+        What of an <Item> has to be extracted for a set of AwsItem fields.
+        tags is the set of ItemAttributes tags or None for all of them.
+    '''
+    __slots__ = ('tags', 'images', 'reviews', 'offers')
+
+    def __init__(self, fields):
+        attribute_fields = {}
+        for tag, field in AwsItem.single_attributes.items() + AwsItem.multi_attributes.items():
+            attribute_fields.setdefault(field, []).append(tag)
+        attribute_fields.update(AwsItem.field_tags)
+        self.tags = set()
+        if 'attributes' in fields:
+            self.tags = None
+        else:
+            for field in fields:
+                self.tags.update(attribute_fields.get(field, ()))
+        self.images = len(set(AwsItem.image_fields.values()) & fields) > 0
+        self.reviews = 'editorial_reviews' in fields or 'description' in fields
+        self.offers = 'lowest_new_price' in fields
+
+_wanted = {}
+
+def _wanted_for(fields):
+    ''' The _Wanted for a frozenset of fields, made once for each set '''
+    wanted = _wanted.get(fields)
+    if wanted == None:
+        wanted = _Wanted(fields)
+        _wanted[fields] = wanted
+    return wanted
+
+def _parse_item(elem, wanted=None):
+    '''
+        Build the AwsItem for a single <Item> in one pass over its children.
+        If what is wanted is given everything else is skipped.
+    '''
+    item = AwsItem()
+    images = AwsItem.image_fields
+    for child in elem:
+        tag = _local(child.tag)
+        if tag == 'ASIN':
+            item.asin = child.text
+        elif tag == 'DetailPageURL':
+            item.detail_page_url = child.text
+        elif wanted != None and not wanted.images and (tag in images or tag == 'ImageSets'):
+            continue
+        elif tag in images:
+            if getattr(item, images[tag]) == None:
+                setattr(item, images[tag], _child_text(child, 'URL'))
+        elif tag == 'ImageSets':
+            ''' Only used if the Item itself didn't have the image size,
+                just like getElementsByTagName finding the first one '''
+            for image_set in child:
+                for image in image_set:
+                    size = _local(image.tag)
+                    if size in images and getattr(item, images[size]) == None:
+                        setattr(item, images[size], _child_text(image, 'URL'))
+        elif tag == 'ItemAttributes':
+            if wanted == None:
+                _item_attributes(item, child)
+            elif wanted.tags == None or wanted.tags:
+                _item_attributes(item, child, wanted.tags)
+        elif tag == 'EditorialReviews':
+            if wanted != None and not wanted.reviews:
+                continue
+            for review in child:
+                item.editorial_reviews.append(
+                    (_child_text(review, 'Source'), _child_text(review, 'Content')))
+        elif tag == 'OfferSummary':
+            if wanted != None and not wanted.offers:
+                continue
+            for price in child:
+                if _local(price.tag) == 'LowestNewPrice':
+                    amount = _child_text(price, 'Amount')
+                    if amount != None:
+                        item.lowest_new_price = int(amount)
+    return item
+
+def _node_id(elem):
+    ''' The BrowseNodeId of elem as an int, or None '''
+    text = _child_text(elem, 'BrowseNodeId')
+    if text == None:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+def _parse_browse_node(elem):
+    ''' AwsBrowseNode for a <BrowseNode> element '''
+    node = AwsBrowseNode(_node_id(elem), _child_text(elem, 'Name'))
+    node.is_category_root = _child_text(elem, 'IsCategoryRoot') == '1'
+    for c in elem:
+        tag = _local(c.tag)
+        if tag == 'Children':
+            node.children = [(_node_id(child), _child_text(child, 'Name')) for child in c]
+        elif tag == 'Ancestors':
+            ''' Each ancestor has its own parent nested inside it '''
+            ancestors = c
+            while ancestors != None:
+                parent = None
+                for a in ancestors:
+                    if _local(a.tag) == 'BrowseNode':
+                        parent = a
+                        break
+                if parent == None:
+                    break
+                node.ancestors.append((_node_id(parent), _child_text(parent, 'Name')))
+                ancestors = None
+                for a in parent:
+                    if _local(a.tag) == 'Ancestors':
+                        ancestors = a
+    return node
+
+def parse_response(f, timings=None, fields=None):
+    '''
+        Parse the response read from the file like object f and return an
+        AwsResponse.  Raises AwsParseException if the response is not XML.
+
+        If a timings dictionary is given the seconds spent building the
+        AwsItems are added to its 'extract'.
+
+        If a frozenset of AwsItem field names is given only those fields are
+        filled in, along with the ASIN and DetailPageURL, and the attributes
+        dictionary only has the tags of those fields unless 'attributes' is
+        one of them.
+    '''
+    response = AwsResponse()
+    wanted = None
+    if fields != None:
+        wanted = _wanted_for(fields)
+    if timings != None:
+        timings.setdefault('extract', 0.0)
+    stack = []
+    try:
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            tag = _local(elem.tag)
+            if tag == 'Item' and stack and _local(stack[-1].tag) == 'Items':
+                if timings != None:
+                    start = time.time()
+                    response.append(_parse_item(elem, wanted))
+                    timings['extract'] += time.time() - start
+                else:
+                    response.append(_parse_item(elem, wanted))
+                ''' Done with it so drop it from the tree '''
+                stack[-1].remove(elem)
+            elif tag == 'BrowseNode' and len(stack) == 2 and _local(stack[-1].tag) == 'BrowseNodes':
+                response.append(_parse_browse_node(elem))
+                stack[-1].remove(elem)
+            elif tag == 'Errors':
+                first = True
+                for err in elem:
+                    code = _child_text(err, 'Code')
+                    if code == None:
+                        continue
+                    if first:
+                        response.errors.append(code)
+                        first = False
+                    response.error_details.append((code, _child_text(err, 'Message')))
+            elif tag == 'Error' and len(stack) == 1:
+                ''' The whole request failed, such as SignatureDoesNotMatch or
+                    RequestThrottled, and the root is an ...ErrorResponse '''
+                code = _child_text(elem, 'Code')
+                if code != None:
+                    response.errors.append(code)
+                    response.error_details.append((code, _child_text(elem, 'Message')))
+            elif tag == 'TotalResults':
+                response.total_results = int(elem.text)
+            elif tag == 'TotalPages':
+                response.total_pages = int(elem.text)
+    except SyntaxError as e:
+        ''' ParseError is a subclass of SyntaxError '''
+        raise AwsParseException("Could not parse response: %s" % str(e))
+    return response
+
+_item_tag = re.compile(r'<(/?)Item[\s>]')
+_asin_tag = re.compile(r'<ASIN>\s*([^<\s]*)\s*</ASIN>')
+
+class AwsLazyItem(AwsItem):
+    '''
+        An AwsItem that only has its ASIN until any other field is asked
+        for.  Until then it holds a memoryview of its <Item> in the bytes of
+        the response, which it shares with the other items of the response,
+        and the first field asked for parses just that Item.
+
+        Pickling one that hasn't been parsed keeps just the bytes of its
+        Item so it is still lazy when unpickled.
+    '''
+    __slots__ = ('_raw', '_fields')
+
+    def __init__(self, asin, raw, fields=None):
+        ''' Not AwsItem.__init__ as every slot but the ASIN has to stay unset
+            for __getattr__ to be called '''
+        if not isinstance(raw, memoryview):
+            raw = memoryview(raw)
+        self.asin = asin
+        self._raw = raw
+        self._fields = fields
+
+    def __getattr__(self, name):
+        ''' Only called for a slot that isn't set yet '''
+        if name in AwsItem.__slots__ and self._raw != None:
+            self._load()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def is_loaded(self):
+        return self._raw == None
+
+    def _load(self):
+        wanted = None
+        if self._fields != None:
+            wanted = _wanted_for(self._fields)
+        try:
+            elem = ElementTree.fromstring(self._raw.tobytes())
+        except SyntaxError as e:
+            raise AwsParseException("Could not parse item %s: %s" % (self.asin, str(e)))
+        item = _parse_item(elem, wanted)
+        for name in AwsItem.__slots__:
+            setattr(self, name, getattr(item, name))
+        self._raw = None
+
+    def __reduce__(self):
+        if self._raw == None:
+            ''' Parsed already so it is unpickled as a plain AwsItem '''
+            return (AwsItem, (), AwsItem.__getstate__(self))
+        return (AwsLazyItem, (self.asin, self._raw.tobytes(), self._fields))
+
+    def __reduce_ex__(self, protocol):
+        return self.__reduce__()
+
+def parse_lazy(f, timings=None, fields=None):
+    '''
+        As parse_response but the items are AwsLazyItem.  The response is
+        read into one bytearray and scanned for the byte range of each Item
+        of the Items and its ASIN, without parsing it.  Only what is left
+        around the Items is parsed, for the errors and totals, so the ASINs
+        and number of items of a response cost hardly more than reading it.
+
+        As nothing is extracted the timings 'extract' stays 0.  A response
+        that has no Item, such as that of a BrowseNodeLookup, is simply
+        parsed by parse_response.
+    '''
+    if timings != None:
+        timings.setdefault('extract', 0.0)
+    data = bytearray()
+    while True:
+        chunk = f.read(65536)
+        if not chunk:
+            break
+        data.extend(chunk)
+    view = memoryview(data)
+
+    ranges = []
+    depth = 0
+    for match in _item_tag.finditer(data):
+        if match.group(1):
+            depth -= 1
+            if depth == 0:
+                ranges.append((start, match.end()))
+        else:
+            if depth == 0:
+                start = match.start()
+            depth += 1
+    if not ranges:
+        return parse_response(StringIO(view.tobytes()), timings, fields)
+
+    ''' The response less its Items '''
+    rest = []
+    last = 0
+    for start, end in ranges:
+        rest.append(view[last:start].tobytes())
+        last = end
+    rest.append(view[last:].tobytes())
+    response = parse_response(StringIO(''.join(rest)), timings, fields)
+    for start, end in ranges:
+        match = _asin_tag.search(data, start, end)
+        asin = str(match.group(1)) if match != None else None
+        response.append(AwsLazyItem(asin, view[start:end], fields))
+    return response
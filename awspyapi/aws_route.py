@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+'''
+    Spread requests over several sets of credentials.
+
+    Amazon's rate limit is for each account, so one AwsSearch can't go
+    faster than about a request a second however it sends them.  AwsRouter
+    holds several AwsCredential, each with its own AwsRateLimiter, and
+    sends each request with whichever can send it soonest.  A credential
+    that is throttled backs off on its own while the others carry on, and
+    one whose key is rejected is left out for a while, so the throughput is
+    that of all the healthy credentials together:
+
+        router = AwsRouter([AwsCredential(key1, secret1, tag1, locale='uk'),
+                            AwsCredential(key2, secret2, tag2, locale='uk')])
+        s = AwsSearch(router=router)
+
+    All of the credentials of a router must be for the same endpoint.  Use a
+    router for each locale to search several.
+'''
+import random
+import threading
+import time
+from aws_url import get_signer, locale_url
+from aws_throttle import AwsRateLimiter
+
+class AwsRouteException(Exception):
+    '''
+        Exception type raised by AWS routing code
+    '''
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class AwsCredential(object):
+    '''
+        One key, secret and tag and the endpoint to use them with.
+
+            locale          Such as 'us' or 'de', see aws_url.locale_hosts
+            base_url        Endpoint to use instead of that of the locale
+            rate, burst     Of the AwsRateLimiter of these credentials
+            limiter         AwsRateLimiter to use instead, for instance one
+                            shared with other routers for the same account
+
+        requests and throttled count what was sent with them.
+    '''
+    def __init__(self, key, secret, tag, locale='us', base_url=None, rate=1.0, burst=1,
+                    limiter=None):
+        self.key = key
+        self.secret = secret
+        self.tag = tag
+        if base_url == None:
+            base_url = locale_url(locale)
+        self.base_url = base_url
+        self.signer = get_signer(key, secret, tag, base_url=base_url)
+        if limiter == None:
+            limiter = AwsRateLimiter(rate=rate, burst=burst)
+        self.limiter = limiter
+        self.disabled_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return '<AwsCredential %s %s>' % (self.key, self.signer.host)
+
+class AwsRouter(object):
+    '''
+        Chooses the AwsCredential for each request.  It is used by AwsSearch
+        and AsyncAwsSearch in place of both their AwsSigner and their
+        AwsRateLimiter.
+
+            credentials     List of AwsCredential, all for the same endpoint
+            max_retries     Times a throttled request is tried again, each
+                            time with the credential that can send soonest
+            disable_for     Seconds a credential whose key or signature was
+                            rejected is left out for
+
+        The credential chosen is the one whose limiter would let it send
+        soonest, taking its backoff into account, with ties broken at random
+        so they share the work.
+    '''
+    throttle_codes = AwsRateLimiter.throttle_codes
+    # Error codes that mean the credential itself is bad
+    rejected_codes = set(['InvalidClientTokenId', 'SignatureDoesNotMatch',
+                          'AWS.InvalidAccount', 'AWS.InvalidAssociate'])
+
+    def __init__(self, credentials, max_retries=5, disable_for=300.0):
+        if len(credentials) == 0:
+            raise AwsRouteException("A router needs at least one credential")
+        endpoints = set([(c.signer.host, c.signer.path) for c in credentials])
+        if len(endpoints) > 1:
+            raise AwsRouteException("All of a router's credentials must be for the same endpoint, not %s"
+                                    % ', '.join(['%s%s' % e for e in sorted(endpoints)]))
+        self.credentials = list(credentials)
+        self.max_retries = max_retries
+        self.disable_for = disable_for
+        first = self.credentials[0]
+        self.base_url = first.base_url
+        self.host = first.signer.host
+        self.path = first.signer.path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def choose(self):
+        ''' The AwsCredential that can send a request soonest '''
+        now = time.time()
+        best = []
+        best_wait = None
+        for credential in self.credentials:
+            wait = credential.limiter.wait_time()
+            if credential.disabled_until > now:
+                wait = max(wait, credential.disabled_until - now)
+            if best_wait == None or wait < best_wait:
+                best = [credential]
+                best_wait = wait
+            elif wait == best_wait:
+                best.append(credential)
+        return random.choice(best)
+
+    def is_throttled(self, codes):
+        ''' True if the error codes, as returned by get_errors, include throttling '''
+        for code in codes or ():
+            if code in self.throttle_codes:
+                return True
+        return False
+
+    def is_rejected(self, codes):
+        ''' True if the error codes say the credential was no good '''
+        for code in codes or ():
+            if code in self.rejected_codes:
+                return True
+        return False
+
+    def succeeded(self, credential):
+        credential.limiter.succeeded()
+
+    def throttled(self, credential, attempt):
+        ''' A request sent with credential was throttled on the given attempt.
+            Only that credential backs off. '''
+        with self._lock:
+            credential.throttled += 1
+        credential.limiter.backoff(attempt)
+
+    def rejected(self, credential):
+        ''' Leave out a credential whose key or signature was rejected, unless
+            it's the only one '''
+        with self._lock:
+            credential.rejected += 1
+            if len(self.credentials) > 1:
+                credential.disabled_until = time.time() + self.disable_for
+
+    def sent(self, credential):
+        with self._lock:
+            credential.requests += 1
+
+    def should_retry(self, credential, codes, attempt):
+        ''' Note the error codes of the response to a request sent with
+            credential on the given attempt and say whether to try it again '''
+        if self.is_rejected(codes):
+            self.rejected(credential)
+            return attempt < self.max_retries and len(self.credentials) > 1
+        if self.is_throttled(codes):
+            if attempt >= self.max_retries:
+                with self._lock:
+                    credential.throttled += 1
+                return False
+            self.throttled(credential, attempt)
+            return True
+        self.succeeded(credential)
+        return False
+
+    def call(self, fn, error_codes):
+        '''
+            As AwsRateLimiter.call but each attempt is made with the credential
+            that can send soonest, which sign uses while fn is called.
+        '''
+        attempt = 0
+        while True:
+            credential = self.choose()
+            credential.limiter.acquire()
+            self.sent(credential)
+            self._local.credential = credential
+            try:
+                result = fn()
+            finally:
+                self._local.credential = None
+            if not self.should_retry(credential, error_codes(result), attempt):
+                return result
+            attempt += 1
+
+    def sign(self, params):
+        ''' Sign with the credential of the request being made by call on
+            this thread, or else the one that can send soonest '''
+        credential = getattr(self._local, 'credential', None)
+        if credential == None:
+            credential = self.choose()
+        return credential.signer.sign(params)
+
+    def canonical_query(self, params):
+        ''' The canonical query of the first credential, so the same whichever
+            one a request is sent with '''
+        return self.credentials[0].signer.canonical_query(params)
+
+    def stats(self):
+        ''' Dictionary of the key of each credential to its counts '''
+        with self._lock:
+            return dict((c.key, {'requests': c.requests, 'throttled': c.throttled,
+                                 'rejected': c.rejected, 'rate': c.limiter.rate})
+                        for c in self.credentials)
@@ -1,9 +1,18 @@
 #! /usr/bin/env python
-from aws_url import AwsUrl
+from aws_url import AwsUrl, AwsSigner, get_signer
+from aws_parse import parse_response, parse_lazy, AwsResponse
+from aws_item import AwsItem
+from aws_http import default_pool
+from aws_throttle import default_limiter
+from aws_flight import default_flight
+from aws_future import AwsFuture
+import collections
+import itertools
 import os
 import sys
+import threading
+import time
 import urllib
-from urllib2 import urlopen
 import xml.dom.minidom
 from xml.dom.minidom import parse, parseString
 import codecs
@@ -22,6 +31,75 @@ class AwsSearchException(Exception):
     def __str__(self):
         return repr(self.value)
 
+def _error_codes(result):
+    ''' All of the error codes in an AwsResponse or a minidom document '''
+    if isinstance(result, AwsResponse):
+        return result.errors
+    codes = []
+    for err in result.getElementsByTagName('Error'):
+        for c in err.getElementsByTagName('Code'):
+            codes.append(c.firstChild.data)
+    return codes
+
+class AwsLookupResult(dict):
+    '''
+        Result of AwsSearch.lookup_many.  Maps each ASIN to its AwsItem or None
+        and has an errors dictionary mapping each ASIN that is None to the
+        reason it wasn't found.
+    '''
+    def __init__(self):
+        dict.__init__(self)
+        self.errors = {}
+
+    def collect(self, asins, response):
+        ''' Add the results of one ItemLookup for the given asins '''
+        found = {}
+        for item in response:
+            found[item.asin] = item
+        ''' Amazon puts the offending ItemId in the message of the error.  Any
+            error that doesn't name one, like RequestThrottled, is for the
+            whole request '''
+        by_asin = {}
+        general = None
+        for code, message in response.error_details:
+            named = [asin for asin in asins if message != None and asin in message]
+            for asin in named:
+                by_asin.setdefault(asin, code)
+            if len(named) == 0 and general == None:
+                general = code
+        for asin in asins:
+            if asin in found:
+                self[asin] = found[asin]
+                continue
+            self[asin] = None
+            self.errors[asin] = by_asin.get(asin, general or 'NotReturned')
+
+class _PageFetch(threading.Thread):
+    '''
+        Thread getting one page of an ItemSearch for iter_search.  It is a
+        daemon so a generator that is abandoned doesn't hold up exiting.
+    '''
+    def __init__(self, search, params, fields=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.search = search
+        self.params = params
+        self.fields = fields
+        self.response = None
+        self.exception = None
+
+    def run(self):
+        try:
+            self.response = self.search._request(self.params, fields=self.fields)
+        except Exception as e:
+            self.exception = e
+
+    def result(self):
+        self.join()
+        if self.exception != None:
+            raise self.exception
+        return self.response
+
 class AwsSearch(object):
     '''
     Perform a ItemSearch operation for an item via Amazon Product Advertising 
@@ -86,8 +164,26 @@ class AwsSearch(object):
             'AudienceRating','Manufacturer','MusicLabel','Composer','Publisher',
             'Brand','Conductor','Orchestra','TextStream','Cuisine','City','Neighborhood'])
 
+    # Most ASINs Amazon accepts in the ItemId of a single ItemLookup
+    max_lookup_asins = 10
+    # Most BrowseNodeIds a BrowseNodeLookup takes
+    max_browse_nodes = 10
+
+    # Response parsers that may be selected with the parser argument
+    valid_parsers = set(['etree', 'minidom', 'lazy'])
+    # The parsers that give an AwsResponse, which can be cached and shared
+    response_parsers = (parse_response, parse_lazy)
+
+    # About how much each ResponseGroup adds to a response, for choosing the
+    # smallest one that has the fields asked for
+    response_group_costs = {'Small': 1, 'OfferSummary': 1, 'Images': 2, 'ItemAttributes': 3,
+                            'EditorialReview': 5, 'Medium': 15, 'Large': 40}
+    _group_covers = {}
+
     def __init__(self, tag=None, key=None, secret=None, asin=None, search_index = None, 
-                    search_params = {},verbose=False):
+                    search_params = {},verbose=False, parser='etree', transport=None,
+                    limiter=None, cache=None, flight=None, base_url=None, instrument=None,
+                    router=None):
         '''
             Constructor for search including search_index and a model set of search parameters
             that is only intended to serve as an example but should return a valid result.
@@ -101,8 +197,66 @@ class AwsSearch(object):
             If the secret isn't provided and attempt is made to get it from the 
             AWS_SECRET environment variable which throws an exception if it fails
 
+            The parser selects how responses are parsed.  The default 'etree'
+            streams the response and keeps only a compact AwsItem for each Item
+            so the items returned by the various methods are AwsItem objects.
+            'minidom' is the original behavior of keeping the whole DOM and
+            returning DOM elements.  'lazy' keeps the bytes of the response
+            and gives AwsLazyItem objects which only parse their Item when a
+            field other than the ASIN is asked for, so get_all_item_asins and
+            counting the items never parse one.
+
+            The transport is the AwsConnectionPool used to send requests.  If
+            not given the one shared by all AwsSearch objects is used.  Likewise
+            the limiter is the AwsRateLimiter every request waits on and if not
+            given the one shared by all AwsSearch objects is used.
+
+            If a cache such as AwsMemoryCache is given then responses are kept
+            there and requests the same as one already made are answered from
+            it.  Only the etree and lazy parsers use the cache, each keeping
+            its own responses so they can share one.
+
+            The flight is the AwsSingleFlight that makes identical requests
+            made at the same time share one.  If not given the one shared by
+            all AwsSearch objects is used.  It too is only for the etree and lazy
+            parsers.
+
+            Requests go to base_url if given rather than Amazon, for instance
+            to the base_url of an AwsMockServer or locale_url('de').
+
+            If a router such as AwsRouter is given each request is signed with
+            and waits on the limiter of whichever of its credentials it
+            chooses.  It then takes the place of the tag, key, secret, limiter
+            and base_url.
+
+            If an instrument such as AwsStats is given it is told the time
+            taken by each phase of each request and counts of bytes, retries,
+            cache hits and error codes.
+
+            Neither the ASIN nor the search index and parameters are needed
+            if the AwsSearch is only going to be used for lookup_many.
+
         '''                         
         self.verbose = verbose
+        if parser not in self.valid_parsers:
+            raise AwsSearchException("Unknown parser '%s'.  Must be one of %s" % (parser, ', '.join(self.valid_parsers)))
+        self.parser = parser
+        self.response_parser = parse_lazy if parser == 'lazy' else parse_response
+        if transport == None:
+            transport = default_pool()
+        self.transport = transport
+        if limiter == None:
+            limiter = default_limiter()
+        self.limiter = limiter
+        self.cache = cache
+        if flight == None:
+            flight = default_flight()
+        self.flight = flight
+        self.router = router
+        if router != None:
+            self.limiter = router
+            credential = router.credentials[0]
+            tag, key, secret, base_url = credential.tag, credential.key, credential.secret, router.base_url
         if (tag == None):
             ''' Attempt to get tag from environment variable AWS_TAG '''
             try:
@@ -130,19 +284,237 @@ class AwsSearch(object):
                 raise AwsSearchException("Please set the AWS_SECRET environment variable or provide it to the constructor")
         else:
             self.secret = secret
-
-        if asin != None:
-            self.asin = asin
+        self.base_url = base_url
+        self.instrument = instrument
+        if router != None:
+            self.signer = router
         else:
+            self.signer = get_signer(self.key, self.secret, self.tag, base_url=base_url)
+
+        self.asin = asin
+        self.search_index = search_index    
+        self.search_params = search_params
+        if asin == None and (search_index != None or len(search_params) != 0):
             ''' Must provide search index and at least one parameter if asin isn't none '''
             if search_index == None or len(search_params) == 0:
                 raise(AwsSearchException("You must provide an ASIN or else a search index and at least one parameter"))
-            else:
-                self.search_index = search_index    
-                self.search_params = search_params
 
-        ''' When a search is actually performed this will be set to the resultant dom '''
+        ''' When a search is actually performed one of these will be set to the
+            resultant dom or the parsed response depending on the parser '''
         self.search_result_dom = None
+        self.search_result = None
+
+    def _parse(self, params, fields=None):
+        ''' Send the request with the selected parser and keep the dom or
+            AwsResponse accordingly.  Returns whichever it is.
+        '''
+        if self.parser == 'minidom':
+            self.search_result_dom = self._request(params, parse)
+            return self.search_result_dom
+        self.search_result = self._request(params, fields=fields)
+        return self.search_result
+
+    @classmethod
+    def response_groups(cls, fields):
+        '''
+            The cheapest ResponseGroup that has all of the AwsItem fields, such
+            as ['title', 'medium_image', 'asin'], as a string for the request.
+            Returns (group, fields) where fields is the frozenset of the field
+            names with any aliases, such as 'medium_image' for
+            'medium_image_url', replaced.
+        '''
+        wanted = set()
+        for field in fields:
+            field = AwsItem.field_aliases.get(field, field)
+            if field not in AwsItem.field_groups:
+                raise AwsSearchException("Unknown field '%s'" % field)
+            wanted.add(field)
+        wanted = frozenset(wanted)
+        group = cls._group_covers.get(wanted)
+        if group == None:
+            group = cls._cheapest_cover(wanted)
+            cls._group_covers[wanted] = group
+        return group, wanted
+
+    @classmethod
+    def _cheapest_cover(cls, fields):
+        ''' Try every combination of the groups that have any of the fields
+            and keep the cheapest one that has all of them '''
+        needed = [set(AwsItem.field_groups[f]) for f in fields if AwsItem.field_groups[f]]
+        if not needed:
+            return 'Small'
+        candidates = sorted(set.union(*needed))
+        best = None
+        for size in range(1, len(candidates) + 1):
+            for groups in itertools.combinations(candidates, size):
+                chosen = set(groups)
+                if all(chosen & groups_of_field for groups_of_field in needed):
+                    cost = sum(cls.response_group_costs[g] for g in groups)
+                    if best == None or cost < best[0]:
+                        best = (cost, groups)
+        return ','.join(sorted(best[1]))
+
+    def _group_for(self, group, fields):
+        ''' The ResponseGroup and frozenset of fields to ask for.  Without
+            fields it's just the group given. '''
+        if fields == None:
+            return group, None
+        return self.response_groups(fields)
+
+    def _search_params(self, search_index, search_params, group='Images,ItemAttributes'):
+        ''' Parameters for an ItemSearch.  This is a new dictionary so the
+            caller's search parameters aren't changed
+        '''
+        params = dict(search_params)
+        ''' For the AWS URL we must create the SearchIndex parameter '''
+        params['SearchIndex'] = search_index
+        params['ResponseGroup'] = group
+        ''' And of course need the operation '''
+        params['Operation'] = 'ItemSearch'
+        return params
+
+    def _lookup_params(self, asins, group):
+        ''' Parameters for an ItemLookup of at most max_lookup_asins ASINs '''
+        params = {}
+        params['IdType'] = 'ASIN'
+        params['ItemId'] = ','.join(asins)
+        params['ResponseGroup'] = group
+        params['Operation'] = 'ItemLookup'
+        return params
+
+    def _signed_url(self, params):
+        ''' Sign the URL for the given parameters '''
+        url_signed = self.signer.sign(params)
+
+        if self.verbose:
+            print 'AWS URL: ', url_signed
+        return url_signed
+
+    def _request(self, params, parser=None, fields=None):
+        ''' Sign and send a request with the given parameters and return the
+            response parsed by parser, by default the AwsResponse of the
+            response_parser of the AwsSearch.  Unlike
+            do_search this doesn't keep anything in the AwsSearch.
+
+            The request waits its turn with the rate limiter and is retried if
+            throttled.  It is signed again for each try so the Timestamp is
+            always current.
+
+            If there is a cache AwsResponses are looked for there first and
+            kept there after.  A request identical to one already in flight,
+            from any thread, waits for that one's AwsResponse rather than
+            being sent too.
+
+            fields is the frozenset of AwsItem fields to fill in, or None for
+            all of them, as for parse_response.
+        '''
+        instrument = self.instrument
+        if instrument != None:
+            start = time.time()
+        if parser == None:
+            parser = self.response_parser
+        try:
+            if parser not in self.response_parsers:
+                return self._fetch(params, parser, None)
+
+            key = self._cache_key(params, fields, parser)
+            if self.cache != None:
+                response = self.cache.get(key)
+                if instrument != None:
+                    instrument.count('cache_hits' if response != None else 'cache_misses')
+                if response != None:
+                    return response
+            fetched = []
+            def fetch():
+                fetched.append(True)
+                return self._fetch(params, parser, key, fields)
+            response = self.flight.call(key, fetch)
+            if instrument != None and not fetched:
+                instrument.count('coalesced')
+            return response
+        finally:
+            if instrument != None:
+                instrument.timing('total', time.time() - start)
+
+    def _fetch(self, params, parser, key, fields=None):
+        ''' Send the request for _request and keep the result in the cache
+            if there is one and a key is given '''
+        size = [0]
+        attempts = [0]
+        instrument = self.instrument
+        def send():
+            attempts[0] += 1
+            if instrument != None:
+                start = time.time()
+            url_signed = self._signed_url(params)
+            if instrument != None:
+                instrument.timing('sign', time.time() - start)
+            f = self.transport.urlopen( url_signed )
+            try:
+                if instrument != None:
+                    result = self._instrumented_parse(f, parser, fields)
+                elif parser in self.response_parsers:
+                    result = parser(f, None, fields)
+                else:
+                    result = parser(f)
+                ''' The cache counts the size of the XML, not what was sent '''
+                size[0] = getattr(f, 'bytes_decoded', getattr(f, 'bytes_read', 0))
+                return result
+            finally:
+                f.close()
+        result = self.limiter.call(send, _error_codes)
+
+        if instrument != None:
+            instrument.count('requests', attempts[0])
+            if attempts[0] > 1:
+                instrument.count('retries', attempts[0] - 1)
+            for code in _error_codes(result):
+                instrument.count('error.' + code)
+        if key != None and self.cache != None:
+            self.cache.put(key, params['Operation'], result, size[0])
+        return result
+
+    def _instrumented_parse(self, f, parser, fields=None):
+        ''' Parse the response and tell the instrument how long each part took '''
+        instrument = self.instrument
+        timings = {'extract': 0.0}
+        start = time.time()
+        if parser in self.response_parsers:
+            result = parser(f, timings, fields)
+        else:
+            result = parser(f)
+        elapsed = time.time() - start
+        if getattr(f, 'connect_time', None) != None:
+            instrument.timing('connect', f.connect_time)
+        if getattr(f, 'ttfb', None) != None:
+            instrument.timing('ttfb', f.ttfb)
+        download = getattr(f, 'read_time', 0.0)
+        instrument.count('bytes', getattr(f, 'bytes_read', 0))
+        instrument.timing('download', download)
+        instrument.timing('parse', max(0.0, elapsed - download - timings['extract']))
+        if parser in self.response_parsers:
+            instrument.timing('extract', timings['extract'])
+        return result
+
+    def _cache_key(self, params, fields=None, parser=None):
+        ''' The canonical query for the parameters which is the cache key.  A
+            response with only some fields is kept apart from a full one, as
+            is one from another endpoint.  So are AwsLazyItems from AwsItems,
+            parser being the response_parser by default, so AwsSearches with
+            different parsers can share a cache. '''
+        key = self.signer.canonical_query(params)
+        if self.signer.host != AwsSigner.host or self.signer.path != AwsSigner.path:
+            key = self.signer.host + self.signer.path + '?' + key
+        if fields != None:
+            key += '#' + ','.join(sorted(fields))
+        if (parser or self.response_parser) == parse_lazy:
+            key += '#lazy'
+        return key
+
+    def _check_results(self):
+        ''' Raise the usual exception if there is nothing to work with yet '''
+        if self.search_result == None and self.search_result_dom == None:
+            raise AwsSearchException("No search results available.  Did you search yet?")
 
 
     def _get_attribute_value(self, item, attr):
@@ -154,9 +526,18 @@ class AwsSearch(object):
         '''
         if attr == None:
             raise AwsSearchException("You must supply an attribute name such as 'Author'")
+        if isinstance(item, AwsItem):
+            field = AwsItem.multi_attributes.get(attr)
+            if field != None:
+                return getattr(item, field)
+            return item.attributes.get(attr, [])
         if item == None:
-            if self.search_result_dom == None:
-                raise AwsSearchException("No search results available.  Did you search yet?")
+            self._check_results()
+            if self.search_result != None:
+                values = []
+                for r in self.search_result:
+                    values.extend(r.attributes.get(attr, ()))
+                return values
             attributes = self.search_result_dom.getElementsByTagName('ItemAttributes')
         else:
             attributes = item.getElementsByTagName('ItemAttributes')
@@ -170,8 +551,25 @@ class AwsSearch(object):
                     values.append(v.firstChild.data)
         return values
 
+    def _get_first_value(self, item, attr):
+        ''' Internal worker for the attributes where only one value is
+            expected.  Returns the first value or None
+        '''
+        if isinstance(item, AwsItem):
+            field = AwsItem.single_attributes.get(attr)
+            if field != None:
+                return getattr(item, field)
+        values = self._get_attribute_value(item, attr)
+        if len(values) > 0:
+            return values[0]
+        else:
+            return None
+
     def get_product_description(self, item):
         ''' Get the ProductDescription Content for the given item '''
+        if isinstance(item, AwsItem):
+            item.description = item.get_editorial_review('Product Description')
+            return item.description
         reviews = item.getElementsByTagName('EditorialReview')
         for r in reviews:
             sources = r.getElementsByTagName('Source')
@@ -191,6 +589,9 @@ class AwsSearch(object):
 
     def get_amazon_review(self, item):
         ''' Get the ProductDescription Content for the given item '''
+        if isinstance(item, AwsItem):
+            item.description = item.get_editorial_review('Amazon.com')
+            return item.description
         reviews = item.getElementsByTagName('EditorialReview')
         for r in reviews:
             sources = r.getElementsByTagName('Source')
@@ -219,52 +620,28 @@ class AwsSearch(object):
         ''' Get publication date.  Really ought to be only one right?
             Only going to return one
         '''
-        values = self._get_attribute_value(item, 'PublicationDate')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'PublicationDate')
 
     def get_title(self, item = None):
         ''' Get Title. Better be only going to return one
         '''
-        values = self._get_attribute_value(item, 'Title')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'Title')
 
     def get_page_count(self, item = None):
         ''' Get pages obviously for books.  '''
-        values = self._get_attribute_value(item, 'NumberOfPages')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'NumberOfPages')
 
     def get_creator(self, item = None):
         ''' Get creator '''
-        values = self._get_attribute_value(item, 'Creator')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'Creator')
 
     def get_format(self, item = None):
         ''' Get Format '''
-        values = self._get_attribute_value(item, 'Format')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'Format')
 
     def get_num_pages(self, item = None):
         ''' Get number of pages '''
-        values = self._get_attribute_value(item, 'NumberOfPages')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'NumberOfPages')
 
     ''' And these are more for movies '''
     def get_actors(self, item=None):
@@ -275,11 +652,7 @@ class AwsSearch(object):
 
     def get_mpaa_rating(self, item=None):
         ''' Get the movie rating, i.e., PG-13 etc. ''' 
-        values = self._get_attribute_value( item, 'AudienceRating')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'AudienceRating')
 
     def get_directors(self, item=None):
         ''' Get the list of directors.  Probably only one but... '''
@@ -287,11 +660,7 @@ class AwsSearch(object):
 
     def get_product_group(self, item=None):
         ''' Like Movie or whatever.  Assume only one '''
-        values = self._get_attribute_value( item, 'ProductGroup')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'ProductGroup')
 
 
     def get_running_time(self, item=None):
@@ -300,16 +669,14 @@ class AwsSearch(object):
             allows for the possibility of other units.
         <RunningTime Units="minutes">104</RunningTime>
         '''
-        values = self._get_attribute_value( item, 'RunningTime')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'RunningTime')
 
     def get_release_date(self, item=None):
         ''' Release date of movie.   First try TheatricalReleaseDate and
             if not found then just ReleaseDate
         '''
+        if isinstance(item, AwsItem):
+            return item.release_date
         values = self._get_attribute_value( item, 'TheatricalReleaseDate')
         if not values or len(values) == 0:
             values = self._get_attribute_value( item, 'ReleaseDate')
@@ -324,11 +691,7 @@ class AwsSearch(object):
     ''' These could be book or movie '''
     def get_binding(self, item=None):
         ''' Like Amazon Instant Video or Blu-ray or Paperback.  Assume only one '''
-        values = self._get_attribute_value( item, 'Binding')
-        if len(values) > 0:
-            return values[0]
-        else:
-            return None
+        return self._get_first_value(item, 'Binding')
 
     def get_genres(self, item=None):
         ''' Like Science Fiction etc.  Maybe more than one sometimes? '''
@@ -346,42 +709,6 @@ class AwsSearch(object):
         <Title>I Am Legend</Title>
     '''
 
-    def get_small_image_url(self, item=None):
-        return self._get_image_url('Small',item)
-
-    def get_medium_image_url(self, item=None):
-        return self._get_image_url('Medium',item)
-
-    def get_large_image_url(self,item=None):
-        return self._get_image_url('Large',item)
-
-    def get_detail_page_url(self, item=None):
-        '''
-        This is the URL for the main product page.  If item==None
-        it just finds the DetailPageURL for the first item found.
-        Otherwise, it returns the one for the given item
-        '''
-        detail_page_url_node = None 
-
-        if item == None: 
-            if self.search_result_dom == None:
-                raise AwsSearchException("No search results available.  Did you search yet?")
-      
-            ''' Return DetailPageUrl for the first item found '''
-            items = self.search_result_dom.getElementsByTagName('Item')
-            for item in items:
-                detail_page_url_node = self.search_result_dom.getElementsByTagName('DetailPageURL')
-                break
-        else:
-            detail_page_url_node = item.getElementsByTagName('DetailPageURL')
-           
-        url = None 
-        if detail_page_url_node != None:
-            for u in detail_page_url_node:
-                url = u.firstChild.data
-                break
-        return url 
-
     def get_item_bindings(self, items=None):
     
         '''
@@ -390,8 +717,9 @@ class AwsSearch(object):
         possible bindings in all items returned by the search
         '''
         if items == None:
-            if self.search_result_dom == None:
-                raise AwsSearchException("No search results available.  Did you search yet?")
+            self._check_results()
+            if self.search_result != None:
+                items = self.search_result
 
         binding_set = set([])
         if items == None:
@@ -400,6 +728,9 @@ class AwsSearch(object):
                 binding_set.add(b.firstChild.nodeValue)
         else:
             for i in items:
+                if isinstance(i, AwsItem):
+                    binding_set.update(i.attributes.get('Binding', ()))
+                    continue
                 bindings = i.getElementsByTagName('Binding')
                 for b in bindings:
                     binding_set.add(b.firstChild.nodeValue)
@@ -411,6 +742,9 @@ class AwsSearch(object):
             After doing a search (or a lookup but it would be redundant) get the
             ASIN for an item
         '''
+        if isinstance(item, AwsItem):
+            self.asin = item.asin or ''
+            return self.asin
         asin = item.getElementsByTagName('ASIN')
         ''' Really don't expect more than one but...'''
         for a in asin:
@@ -424,8 +758,9 @@ class AwsSearch(object):
             ASIN for an item
         '''
 
-        if self.search_result_dom == None:
-            raise AwsSearchException("No search results available.  Did you search yet?")
+        self._check_results()
+        if self.search_result != None:
+            return [r.asin for r in self.search_result if r.asin != None]
 
         item_asins = self.search_result_dom.getElementsByTagName("ASIN")
         asins = list()
@@ -433,29 +768,26 @@ class AwsSearch(object):
             asins.append(a.firstChild.nodeValue)
         return asins
 
-    def do_item_lookup(self, group='Images,ItemAttributes,EditorialReview'):
-        ''' Perform an ItemLookup operation.  Will raise an exception if asin is None or empty '''
+    def do_item_lookup(self, group='Images,ItemAttributes,EditorialReview', fields=None):
+        ''' Perform an ItemLookup operation.  Will raise an exception if asin is None or empty.
+            Returns the AwsItem found, or the DOM element of the Item with the
+            minidom parser, or None if there wasn't one
+
+            If a list of the AwsItem fields that will be used is given, such
+            as ['title', 'medium_image'], the smallest ResponseGroup having
+            them is used instead of group and only they are filled in.
+        '''
         if self.asin == None or len(self.asin) == 0:
             raise(AwsSearchException("ASIN must be provided for do_item_lookup"))
 
-        ''' Create and sign the URL.  For the AWS URL we must create the SearchIndex parameter '''
-        search_params = {}
-        search_params['IdType'] = 'ASIN'
-        search_params['ItemId'] = self.asin
-        search_params['ResponseGroup'] = group
-        ''' And of course need the operation '''
-        search_params['Operation'] = 'ItemLookup'
-
-        aws_url = AwsUrl( 'GET', params = search_params, tag = self.tag, key = self.key, secret = self.secret )
-
-        ''' Sign the URL '''
-        url_signed = aws_url.signed_url()
+        group, fields = self._group_for(group, fields)
+        self._parse(self._lookup_params([self.asin], group), fields)
 
-        f = urlopen( url_signed )
-        self.search_result_dom = parse(f)
-        f.close()
-
-        if self.search_result_dom != None:
+        if self.search_result != None:
+            for i in self.search_result:
+                return i
+            return None
+        elif self.search_result_dom != None:
             ''' Get what should be the only item and return it '''
             items = self.search_result_dom.getElementsByTagName('Item')
             if items == None:
@@ -469,44 +801,155 @@ class AwsSearch(object):
             return None
 
 
-    def do_search(self):
+    def search(self, search_index, search_params, group='Images,ItemAttributes', fields=None):
+        '''
+        ItemSearch returning the AwsResponse.  Unlike do_search nothing is kept
+        in the AwsSearch so any number of threads may call this at once.
+        fields is as for do_item_lookup.
+        '''
+        group, fields = self._group_for(group, fields)
+        return self._request(self._search_params(search_index, search_params, group), fields=fields)
+
+    def item_lookup(self, asin, group='Images,ItemAttributes,EditorialReview', fields=None):
+        '''
+        ItemLookup of one ASIN returning the AwsResponse.  Like search this is
+        safe to call from several threads at once.
+        '''
+        group, fields = self._group_for(group, fields)
+        return self._request(self._lookup_params([asin], group), fields=fields)
+
+    def browse_node_lookup(self, node_ids, group='BrowseNodeInfo'):
+        '''
+        BrowseNodeLookup of up to max_browse_nodes BrowseNodeIds returning an
+        AwsResponse of AwsBrowseNode, each with its children and ancestors.
+        Like search this is safe to call from several threads at once.
+        '''
+        if len(node_ids) > self.max_browse_nodes:
+            raise AwsSearchException("At most %d BrowseNodeIds can be looked up at once" % self.max_browse_nodes)
+        params = {}
+        params['BrowseNodeId'] = ','.join([str(node_id) for node_id in node_ids])
+        params['ResponseGroup'] = group
+        params['Operation'] = 'BrowseNodeLookup'
+        return self._request(params)
+
+    def lookup_many(self, asins, group='Images,ItemAttributes,EditorialReview', fields=None):
+        '''
+        Perform ItemLookup operations for any number of ASINs.  Amazon accepts
+        up to 10 ASINs in one ItemLookup so the ASINs are sent 10 at a time
+        with each request signed once.  
+
+        Returns an AwsLookupResult which is a dictionary mapping every ASIN
+        to its AwsItem, or None if it wasn't returned.  For those the errors
+        dictionary of the result has the error code for the ASIN, such as 
+
+            'AWS.InvalidParameterValue'
+
+        for an invalid ASIN, or 'NotReturned' if Amazon just didn't return
+        it and didn't say why.
+
+        Unlike do_item_lookup this doesn't change the search results
+        of the AwsSearch.  fields is as for do_item_lookup.
+        '''
+        group, fields = self._group_for(group, fields)
+        result = AwsLookupResult()
+        for batch in self._lookup_batches(asins):
+            response = self._request(self._lookup_params(batch, group), fields=fields)
+            result.collect(batch, response)
+        return result
+
+    @classmethod
+    def _lookup_batches(cls, asins):
+        ''' Split the ASINs into lists of at most max_lookup_asins leaving out
+            blanks and duplicates.  asins may be a generator, it is only read
+            as the lists are taken.
+        '''
+        seen = set()
+        batch = []
+        for asin in asins:
+            asin = asin.strip()
+            if len(asin) == 0 or asin in seen:
+                continue
+            seen.add(asin)
+            batch.append(asin)
+            if len(batch) == cls.max_lookup_asins:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def iter_search(self, search_index, search_params, max_pages=10,
+                    group='Images,ItemAttributes', prefetch=2, fields=None, errors=None):
+        '''
+        Generator of the AwsItem of every page of an ItemSearch, in order.
+        The first page says how many there are in TotalPages and at most
+        max_pages are fetched.  Amazon won't return more than 10 pages
+        (5 for the All search index) anyway.
+
+        While the items of one page are being used up to prefetch pages
+        after it are already being fetched by threads of their own, still
+        each waiting its turn with the rate limiter.  No more than that are
+        ever held so memory doesn't grow with the number of pages.
+
+        A first page with errors and no items, such as no matches, just
+        ends the generator, adding its error codes to the errors list if one
+        is given.  A later page like that raises AwsSearchException.  fields
+        is as for do_item_lookup.
+        '''
+        group, fields = self._group_for(group, fields)
+        params = self._search_params(search_index, search_params, group)
+        params['ItemPage'] = '1'
+        response = self._request(params, fields=fields)
+        pages = min(response.total_pages or 1, max_pages)
+        if errors != None and len(response) == 0:
+            errors.extend(response.errors)
+
+        fetching = collections.deque()
+        next_page = 2
+        page = 1
+        while True:
+            while next_page <= pages and len(fetching) < prefetch:
+                params = self._search_params(search_index, search_params, group)
+                params['ItemPage'] = str(next_page)
+                fetch = _PageFetch(self, params, fields)
+                fetch.start()
+                fetching.append(fetch)
+                next_page += 1
+            if len(response) == 0 and len(response.errors) > 0 and page > 1:
+                raise AwsSearchException("ItemPage %d failed: %s" % (page, ', '.join(response.errors)))
+            for item in response:
+                yield item
+            if not fetching:
+                return
+            ''' Let go of this page before waiting for the next '''
+            response = None
+            response = fetching.popleft().result()
+            page += 1
+
+    def do_search(self, group='Images,ItemAttributes', fields=None):
         '''
         Perform the search given the provided parameters.  The result is returned as
-        a minidom object but it is probably more useful to use the other methods
+        an AwsResponse, which is a list of AwsItem, or as a minidom object
+        if the minidom parser was selected but it is probably more useful to use the other methods
         such as get_small_image, get_item_asin, get_detail_page_url, etc. than 
         to work with the raw dom result.
 
             NOTE:   The search might "succeed" in the sense that it returns some XML
                     but that doesn't mean it was truly successful.  One should always
                     call get_errors() to see if there were any errors 
+
+        The group and fields are as for do_item_lookup.
         '''
          
-        ''' Create and sign the URL.  For the AWS URL we must create the SearchIndex parameter '''
-        self.search_params['SearchIndex'] = self.search_index
-        ''' And the ResponseGroup 
-            
-            TODO: Should make parameter too but this could be default
-        '''
-        self.search_params['ResponseGroup'] ='Images,ItemAttributes'
-        ''' And of course need the operation '''
-        self.search_params['Operation'] = 'ItemSearch'
+        if self.search_index == None:
+            raise(AwsSearchException("A search index and at least one parameter must be provided for do_search"))
 
-        aws_url = AwsUrl( 'GET', params = self.search_params, tag = self.tag, key = self.key, secret = self.secret )
-
-        ''' Sign the URL '''
-        url_signed = aws_url.signed_url()
-
-        if self.verbose:
-            print 'AWS URL: ', url_signed
-
-        f = urlopen( url_signed )
-        self.search_result_dom = parse(f)
-        f.close()
+        group, fields = self._group_for(group, fields)
+        result = self._parse(self._search_params(self.search_index, self.search_params, group), fields)
            
         ''' NOTE:  There might be an error in the search.  The caller
             should check with get_errors
         ''' 
-        return self.search_result_dom
+        return result
 
     def get_errors(self):
         ''' 
@@ -521,6 +964,12 @@ class AwsSearch(object):
 
             'AWS.ECommerceService.NoExactMatches'
         '''
+        self._check_results()
+        if self.search_result != None:
+            if len(self.search_result.errors) == 0:
+                return None
+            return list(self.search_result.errors)
+
         errors = self.search_result_dom.getElementsByTagName('Errors')
         err_list = []
         if errors != None:
@@ -546,9 +995,16 @@ class AwsSearch(object):
         '''
         img_size = size+'Image'
 
+        if isinstance(item, AwsItem):
+            return item.get_image_url(size)
         if item == None:
-            if self.search_result_dom == None:
-                raise AwsSearchException("No search results available.  Did you search yet?")
+            self._check_results()
+            if self.search_result != None:
+                for r in self.search_result:
+                    url = r.get_image_url(size)
+                    if url != None:
+                        return url
+                return None
             img = self.search_result_dom.getElementsByTagName(img_size)
         else:
             img = item.getElementsByTagName(img_size)
@@ -583,9 +1039,14 @@ class AwsSearch(object):
         '''
         detail_page_url_node = None 
 
+        if isinstance(item, AwsItem):
+            return item.detail_page_url
         if item == None: 
-            if self.search_result_dom == None:
-                raise AwsSearchException("No search results available.  Did you search yet?")
+            self._check_results()
+            if self.search_result != None:
+                for r in self.search_result:
+                    return r.detail_page_url
+                return None
       
             ''' Return DetailPageUrl for the first item found '''
             items = self.search_result_dom.getElementsByTagName('Item')
@@ -647,15 +1108,16 @@ class AwsSearch(object):
         insist on an exact match to the title then you might find only one
         if any.
 
-        Return: List of matching DOM elements of type Item or empty list
+        Return: List of matching AwsItem (or DOM elements of type Item
+                if using the minidom parser) or empty list
 
         '''
 
-        if self.search_result_dom == None:
-            raise AwsSearchException("No search results available.  Did you search yet?")
+        self._check_results()
+        if self.search_result != None:
+            return self._match_records(attributes, loose)
 
         items = self.search_result_dom.getElementsByTagName('Item')
-        print '>>>>>>>>>>>>>>. items = ', items
 
         matches = []
 
@@ -710,6 +1172,132 @@ class AwsSearch(object):
                                         print b.firstChild.nodeValue
         '''
 
+    def _match_records(self, attributes, loose):
+        ''' get_items_by_attributes for the AwsItem list of the etree parser.
+            Uses the index of the response which is made on the first call so
+            filtering the same results again is cheap. '''
+        return self.search_result.index().match(attributes, loose)
+
+class LookupBatcher(object):
+    '''
+        Merges ItemLookups of single ASINs asked for by independent callers,
+        such as the threads of a web server, into ItemLookups of up to 10.
+        Amazon counts each request against the rate limit however many ASINs
+        it has so this gets up to 10 times as many lookups done.
+
+            search          The AwsSearch to use.  If not given one is made,
+                            getting the credentials from the environment.
+            max_wait        Seconds an ASIN may wait for others to join it
+                            before its request is sent anyway
+            group           ResponseGroup of every lookup
+            fields          AwsItem fields to ask for instead of the group,
+                            as for do_item_lookup
+            max_in_flight   Most requests sent at once.  While that many are
+                            waiting on Amazon more ASINs just pile up for the
+                            next batch.
+
+        lookup returns an AwsFuture that gets the AwsItem or None if it wasn't
+        found, just like do_item_lookup.  The same ASIN asked for by several
+        callers is only looked up once.  The requests are sent from threads of
+        the batcher so lookup never blocks.  close sends anything still waiting
+        and stops the batcher.
+    '''
+    def __init__(self, search=None, max_wait=0.05, group='Images,ItemAttributes,EditorialReview',
+                    max_in_flight=4, fields=None):
+        if search == None:
+            search = AwsSearch()
+        self.search = search
+        self.max_wait = max_wait
+        self.group = group
+        self.fields = fields
+        self.max_in_flight = max_in_flight
+        self._cond = threading.Condition()
+        self._waiting = collections.OrderedDict()
+        self._slots = threading.Semaphore(max_in_flight)
+        self._thread = None
+        self._closed = False
+        self.lookups = 0
+        self.requests = 0
+
+    def lookup(self, asin):
+        ''' Queue the ASIN for the next ItemLookup and return its AwsFuture '''
+        future = AwsFuture()
+        asin = asin.strip()
+        with self._cond:
+            if self._closed:
+                raise AwsSearchException("LookupBatcher is closed")
+            if asin not in self._waiting:
+                self._waiting[asin] = (time.time(), [])
+            self._waiting[asin][1].append(future)
+            self.lookups += 1
+            if self._thread == None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def close(self):
+        ''' Send whatever is waiting and wait for all of it to be done '''
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._cond.notify()
+        if thread != None:
+            thread.join()
+
+    def _take(self):
+        ''' Wait for the next batch and return it as a list of (asin, futures).
+            None once the batcher is closed and nothing is left. '''
+        full = self.search.max_lookup_asins
+        with self._cond:
+            while len(self._waiting) < full and not self._closed:
+                if self._waiting:
+                    oldest = self._waiting.itervalues().next()[0]
+                    remaining = oldest + self.max_wait - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+            if not self._waiting:
+                return None
+            batch = []
+            while self._waiting and len(batch) < full:
+                asin, (queued, futures) = self._waiting.popitem(last=False)
+                batch.append((asin, futures))
+            self.requests += 1
+            return batch
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            batch = self._take()
+            if batch == None:
+                ''' Closed so wait for the requests still in flight '''
+                for i in xrange(self.max_in_flight - 1):
+                    self._slots.acquire()
+                return
+            sender = threading.Thread(target=self._send, args=(batch,))
+            sender.daemon = True
+            sender.start()
+
+    def _send(self, batch):
+        try:
+            try:
+                result = self.search.lookup_many([asin for asin, futures in batch], self.group,
+                                                 self.fields)
+            except Exception as e:
+                for asin, futures in batch:
+                    for future in futures:
+                        future.set_exception(e)
+                return
+            for asin, futures in batch:
+                for future in futures:
+                    future.set_result(result.get(asin))
+        finally:
+            self._slots.release()
+
 if __name__ == '__main__':
     '''
     Something to test with. You MUST have the AWS environment variables set
@@ -872,10 +1460,11 @@ if __name__ == '__main__':
         else:
             print "Product group is not recognized: " + product_group
 
-    f = codecs.open('aws.xml', encoding='utf-8', mode='w+')
-    #dom.writexml( f, addindent="  ", newl = "\n" )
-    item.writexml( f, addindent="  ", newl = "\n" )
-    f.close()
+    if s.parser == 'minidom':
+        f = codecs.open('aws.xml', encoding='utf-8', mode='w+')
+        #dom.writexml( f, addindent="  ", newl = "\n" )
+        item.writexml( f, addindent="  ", newl = "\n" )
+        f.close()
 
     if main_url != None:
         ''' Make a simple web page, save it, and open it '''
@@ -886,12 +1475,12 @@ if __name__ == '__main__':
 	if med_img_url != None:
   	    html += '<a href="'+main_url+'"><img src="'+med_img_url+'"></a>'
         try:
-            s.get_amazon_review(item)
-            if len(item.description) == 0:
-                s.get_product_description(item)
-            if len(item.description) != 0:
+            description = s.get_amazon_review(item)
+            if len(description) == 0:
+                description = s.get_product_description(item)
+            if len(description) != 0:
                 html += '<h2>Description</h2>'
-                html += '<p>' + item.description + '</p>' 
+                html += '<p>' + description + '</p>' 
         except Exception as e:
             print "Exception getting product description: ", str(e)
         finally:
@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+'''
+    Instrumentation of requests.
+
+    An AwsSearch or AsyncAwsSearch given an instrument tells it how long
+    each phase of each request took and counts things such as bytes read,
+    retries and error codes.  An instrument is any object with the two
+    methods of AwsStats:
+
+        timing(phase, seconds)
+        count(name, value)
+
+    so the numbers can go straight to a metrics system.  AwsStats keeps an
+    AwsHistogram for each phase and a total for each count, and passes
+    everything on to any callbacks it is given as well.
+
+    The phases of a request are
+
+        sign        Signing the URL
+        connect     Resolving the host and connecting.  Not there when a
+                    pooled connection was reused.
+        ttfb        From sending the request to having the response headers
+        download    Reading the body
+        parse       Parsing the XML, not counting download and extract
+        extract     Building the AwsItems from the parsed Items
+        total       The whole request from the caller's point of view,
+                    including waiting on the rate limiter and retries
+
+    and the counts are requests, retries, bytes, cache_hits, cache_misses,
+    coalesced and error.<Code> for each error code of the responses.
+'''
+import threading
+
+class AwsHistogram(object):
+    '''
+        Histogram of durations in the manner of HdrHistogram.  Values are kept
+        in microseconds in buckets whose width grows with the value so every
+        value is within about 1% of what was recorded whatever its size, and
+        memory only depends on the range of values, not how many there are.
+    '''
+    # Sub-buckets for each power of two.  128 gives better than 1% precision.
+    sub_bucket_bits = 7
+
+    def __init__(self):
+        self._half = 1 << (self.sub_bucket_bits - 1)
+        self._limit = 1 << self.sub_bucket_bits
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, us):
+        if us < self._limit:
+            return us
+        shift = us.bit_length() - self.sub_bucket_bits
+        return shift * self._half + (us >> shift)
+
+    def _value(self, index):
+        ''' Middle of the bucket in microseconds '''
+        if index < self._limit:
+            return index
+        shift = index // self._half - 1
+        low = (index - shift * self._half) << shift
+        return low + (1 << shift) // 2
+
+    def record(self, seconds):
+        us = max(0, int(seconds * 1e6))
+        index = self._index(us)
+        with self._lock:
+            self._counts[index] = self._counts.get(index, 0) + 1
+            self.count += 1
+            self.total += seconds
+            if self.min == None or seconds < self.min:
+                self.min = seconds
+            if self.max == None or seconds > self.max:
+                self.max = seconds
+
+    def merge(self, other):
+        ''' Add the values of another AwsHistogram to this one '''
+        with other._lock:
+            counts = dict(other._counts)
+            count, total, low, high = other.count, other.total, other.min, other.max
+        with self._lock:
+            for index, n in counts.iteritems():
+                self._counts[index] = self._counts.get(index, 0) + n
+            self.count += count
+            self.total += total
+            if low != None and (self.min == None or low < self.min):
+                self.min = low
+            if high != None and (self.max == None or high > self.max):
+                self.max = high
+
+    def percentile(self, p):
+        ''' Seconds that p percent of the values are at or below, or None if empty '''
+        with self._lock:
+            if self.count == 0:
+                return None
+            wanted = max(1, int(round(self.count * p / 100.0)))
+            seen = 0
+            for index in sorted(self._counts):
+                seen += self._counts[index]
+                if seen >= wanted:
+                    return min(max(self._value(index) / 1e6, self.min), self.max)
+            return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def reset(self):
+        with self._lock:
+            self._counts = {}
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def snapshot(self):
+        ''' Dictionary of count, mean, min, max, p50, p95 and p99 in seconds '''
+        return {'count': self.count, 'mean': self.mean(), 'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99)}
+
+class AwsStats(object):
+    '''
+        Instrument keeping an AwsHistogram of each phase and the total of each
+        count.  Each callback is called as callback(kind, name, value) where
+        kind is 'timing' or 'count', from whichever thread made the request.
+    '''
+    def __init__(self, callbacks=()):
+        self.callbacks = list(callbacks)
+        self._histograms = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def timing(self, phase, seconds):
+        self.histogram(phase).record(seconds)
+        for callback in self.callbacks:
+            callback('timing', phase, seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+        for callback in self.callbacks:
+            callback('count', name, value)
+
+    def histogram(self, phase):
+        ''' The AwsHistogram of the phase, which is empty if it hasn't happened '''
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram == None:
+                histogram = AwsHistogram()
+                self._histograms[phase] = histogram
+            return histogram
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def snapshot(self):
+        ''' {'timings': {phase: AwsHistogram.snapshot()}, 'counts': {name: total}} '''
+        with self._lock:
+            histograms = dict(self._histograms)
+            counts = dict(self._counts)
+        return {'timings': dict((phase, h.snapshot()) for phase, h in histograms.iteritems()),
+                'counts': counts}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counts = {}
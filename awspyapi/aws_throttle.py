@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+'''
+    Client side rate limiting for the Product Advertising API.
+
+    Amazon allows about one request a second for each account and answers
+    anything faster with RequestThrottled.  AwsRateLimiter is a token bucket
+    that every request of AwsSearch, BulkExecutor and AsyncAwsSearch goes
+    through.  When a request is throttled anyway it backs off exponentially
+    with jitter, slows its rate down for everybody sharing it and retries.
+
+    It is thread safe and reserve() never blocks so the asyncore loop of
+    AsyncAwsSearch can schedule a request for later instead of sleeping.
+'''
+import random
+import threading
+import time
+
+class AwsRateLimiter(object):
+    '''
+        Token bucket with adaptive backoff.
+
+            rate            Requests per second normally allowed
+            burst           Most requests that may be sent at once after
+                            being idle for a while
+            max_retries     Times a throttled request is retried before
+                            its response is just returned
+            base_delay      Seconds of backoff for the first retry.  It
+                            doubles for each retry after that.
+            max_delay       Longest backoff in seconds
+            min_rate        When throttled the rate is halved but never
+                            to below this.  It then creeps back up to rate
+                            with each request that isn't throttled.
+    '''
+    # Error codes from get_errors that mean slow down
+    throttle_codes = set(['AWS.RequestThrottled', 'RequestThrottled'])
+
+    def __init__(self, rate=1.0, burst=1, max_retries=5, base_delay=1.0, max_delay=30.0,
+                    min_rate=0.1):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_rate = min(min_rate, self.max_rate)
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._resume = 0.0
+        self.throttled_count = 0
+        self.retry_count = 0
+
+    def reserve(self):
+        '''
+            Take the next token and return how many seconds to wait before
+            sending the request, which is 0.0 if it may be sent now.  The
+            token is the caller's whether it waits or not.
+        '''
+        with self._lock:
+            now = time.time()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1.0
+            delay = 0.0
+            if self._tokens < 0:
+                delay = -self._tokens / self.rate
+            return max(delay, self._resume - now)
+
+    def wait_time(self):
+        ''' Seconds until a request could be sent, like reserve but without
+            taking the token '''
+        with self._lock:
+            now = time.time()
+            tokens = min(float(self.burst), self._tokens + (now - self._last) * self.rate)
+            delay = 0.0
+            if tokens < 1.0:
+                delay = (1.0 - tokens) / self.rate
+            return max(delay, self._resume - now)
+
+    def acquire(self):
+        ''' Wait until a request may be sent '''
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def is_throttled(self, codes):
+        ''' True if the error codes, as returned by get_errors, include throttling '''
+        if codes == None:
+            return False
+        for code in codes:
+            if code in self.throttle_codes:
+                return True
+        return False
+
+    def succeeded(self):
+        ''' A request wasn't throttled so speed back up a little '''
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20.0)
+
+    def backoff(self, attempt):
+        '''
+            A request was throttled on the given attempt, counting from 0, and
+            is going to be retried.  Halve the rate and hold off everybody
+            sharing the limiter for the exponential backoff with full jitter.
+            Returns that delay.
+        '''
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        with self._lock:
+            self.throttled_count += 1
+            self.retry_count += 1
+            self.rate = max(self.min_rate, self.rate / 2.0)
+            self._resume = max(self._resume, time.time() + delay)
+        return delay
+
+    def call(self, fn, error_codes):
+        '''
+            Call fn, which sends a request and returns its result, as soon as
+            the rate allows.  error_codes(result) gives the error codes of the
+            result and if it was throttled it is retried after backing off.
+            Returns the last result which may still be throttled if the
+            retries ran out.
+        '''
+        attempt = 0
+        while True:
+            self.acquire()
+            result = fn()
+            if not self.is_throttled(error_codes(result)):
+                self.succeeded()
+                return result
+            if attempt >= self.max_retries:
+                with self._lock:
+                    self.throttled_count += 1
+                return result
+            self.backoff(attempt)
+            attempt += 1
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+def default_limiter():
+    ''' The AwsRateLimiter shared by every AwsSearch not given its own '''
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter == None:
+            _default_limiter = AwsRateLimiter()
+        return _default_limiter
@@ -3,12 +3,15 @@
 import hashlib
 import hmac
 import urllib
-from urllib2 import urlopen
+import urlparse
+from aws_http import AwsConnectionPool
 from urllib import quote
 from hashlib import *
 import time
 import sys
 import base64
+import threading
+from collections import OrderedDict
 import xml.dom.minidom
 from xml.dom.minidom import parse, parseString
 import webbrowser
@@ -24,14 +27,174 @@ class AwsUrlException(Exception):
     def __str__(self):
         return repr(self.value)
 
+# Product Advertising API host of each locale
+locale_hosts = {
+        'us': 'webservices.amazon.com', 'ca': 'webservices.amazon.ca',
+        'uk': 'webservices.amazon.co.uk', 'de': 'webservices.amazon.de',
+        'fr': 'webservices.amazon.fr', 'it': 'webservices.amazon.it',
+        'es': 'webservices.amazon.es', 'jp': 'webservices.amazon.co.jp',
+        'cn': 'webservices.amazon.cn', 'in': 'webservices.amazon.in',
+        'br': 'webservices.amazon.com.br', 'mx': 'webservices.amazon.com.mx'}
+
+def locale_url(locale):
+    ''' The base URL of the Product Advertising API for a locale such as 'uk' '''
+    if locale not in locale_hosts:
+        raise AwsUrlException("Unknown locale '%s'.  Must be one of %s" % (locale, ', '.join(sorted(locale_hosts))))
+    return 'http://' + locale_hosts[locale] + '/onca/xml'
+
+def signed_endpoint(base_url):
+    '''
+        The (host, path) that are signed for requests to base_url.  The host
+        is what is sent in the Host header, so lower case and with the port
+        only if it isn't the default for the scheme.
+    '''
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(base_url)
+    host = netloc.lower()
+    if (scheme == 'http' and host.endswith(':80')) or (scheme == 'https' and host.endswith(':443')):
+        host = host.rsplit(':', 1)[0]
+    return host, path or '/'
+
+class AwsSigner(object):
+    '''
+        Signs request parameters for one set of credentials.  AwsUrl builds
+        everything again for each URL but the signer does the expensive parts
+        once:
+
+            The HMAC for the secret is keyed once and only copied for each
+            signature rather than made again with hmac.new
+
+            The escaped forms of parameter names and of the values that are
+            the same for most requests, such as Operation and ResponseGroup,
+            are remembered
+
+            The Timestamp is only formatted once a second
+
+        sign never changes the parameters given to it so it is safe to use one
+        signer from any number of threads.
+
+        If tag is None no AssociateTag is added, which is only useful for
+        checking against Amazon's old test vectors.
+
+        The host and path signed are those of base_url, so it may be the URL
+        of another locale, see locale_url, or of an AwsMockServer.
+    '''
+    # Default base URL and what is signed for it
+    base_url = 'http://webservices.amazon.com/onca/xml'
+    host = 'webservices.amazon.com'
+    path = '/onca/xml'
+
+    # Parameters whose values are worth remembering the escaped form of
+    static_params = set(['Service', 'Operation', 'ResponseGroup', 'SearchIndex', 'IdType',
+                         'Version', 'AWSAccessKeyId', 'AssociateTag', 'Condition'])
+
+    def __init__(self, key, secret, tag=None, method='GET', base_url=None, version='2009-01-06'):
+        self.key = key
+        self.tag = tag
+        self.method = method.upper()
+        if base_url != None:
+            self.base_url = base_url
+            self.host, self.path = signed_endpoint(base_url)
+        self.version = version
+        self._prefix = self.method + "\n" + self.host + "\n" + self.path + "\n"
+        self._hmac = hmac.new(key=secret, digestmod=hashlib.sha256)
+        self._quoted = {}
+        self._timestamp = (None, None)
+
+    def _quote(self, s):
+        ''' Escape as Amazon requires, which is everything but the RFC 3986
+            unreserved characters, with unicode as UTF-8 '''
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        return quote(s, safe='~')
+
+    def _quote_static(self, s):
+        quoted = self._quoted.get(s)
+        if quoted == None:
+            quoted = self._quote(s)
+            self._quoted[s] = quoted
+        return quoted
+
+    def timestamp(self):
+        ''' Current Timestamp already escaped, formatted at most once a second '''
+        now = int(time.time())
+        second, stamp = self._timestamp
+        if second != now:
+            stamp = self._quote(time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)))
+            self._timestamp = (now, stamp)
+        return stamp
+
+    def _paramset(self, params, timestamp):
+        ''' Sorted list of escaped (name, value) including the parameters every
+            request needs.  With timestamp False there is no Timestamp. '''
+        paramset = []
+        for k, v in params.iteritems():
+            if k == 'Signature' or (k == 'Timestamp' and not timestamp):
+                continue
+            if k in self.static_params:
+                paramset.append((self._quote_static(k), self._quote_static(v)))
+            else:
+                paramset.append((self._quote_static(k), self._quote(v)))
+        if 'Service' not in params:
+            paramset.append(('Service', 'AWSECommerceService'))
+        if 'AWSAccessKeyId' not in params:
+            paramset.append(('AWSAccessKeyId', self._quote_static(self.key)))
+        if 'AssociateTag' not in params and self.tag != None:
+            paramset.append(('AssociateTag', self._quote_static(self.tag)))
+        if 'Version' not in params:
+            paramset.append(('Version', self._quote_static(self.version)))
+        if 'Timestamp' not in params and timestamp:
+            paramset.append(('Timestamp', self.timestamp()))
+        paramset.sort()
+        return paramset
+
+    def canonical_query(self, params):
+        ''' The sorted and escaped parameter string without the Timestamp '''
+        return '&'.join(['%s=%s' % (k, v) for k, v in self._paramset(params, False)])
+
+    def sign(self, params):
+        '''
+            The signed URL for the parameters.  A Timestamp in the parameters is
+            used instead of the current time which, like AwsUrl, is only really
+            for testing against test vectors.
+        '''
+        paramstring = '&'.join(['%s=%s' % (k, v) for k, v in self._paramset(params, True)])
+        m = self._hmac.copy()
+        m.update(self._prefix + paramstring)
+        # Escape all of it, including '/', just as Amazon's examples do
+        signature = quote(base64.b64encode(m.digest()), safe='')
+        return self.base_url + '?' + paramstring + '&Signature=' + signature
+
+# Most AwsSigners get_signer keeps.  The least recently used go first so
+# the signers of old credentials, and their secrets, don't pile up.
+max_signers = 16
+_signers = OrderedDict()
+_signers_lock = threading.Lock()
+
+def get_signer(key, secret, tag=None, method='GET', base_url=None):
+    ''' The AwsSigner for the credentials, made only the first time unless
+        it has since been dropped for newer ones.  They are kept by a
+        digest of the secret rather than the secret itself. '''
+    k = (key, hashlib.sha256(secret).digest(), tag, method, base_url)
+    with _signers_lock:
+        signer = _signers.pop(k, None)
+        if signer == None:
+            signer = AwsSigner(key, secret, tag, method, base_url)
+        _signers[k] = signer
+        while len(_signers) > max_signers:
+            _signers.popitem(last=False)
+        return signer
+
 class AwsUrl(object):
     '''
         Construct a URL object.  After initial construction 
         the steps to follow are to add any additional parameters
-        using add_param, finalize the URL using finalize,
-        and sign using sign
+        using add_param and then sign using signed_url.
+
+        The parameters given are copied so they're never changed.
+        The signing is done by the AwsSigner for the credentials which
+        is kept around for the next AwsUrl with the same ones.
     '''
-    def __init__(self, method='GET', base_url = None, params={}, tag = None, key = None, secret = None ):
+    def __init__(self, method='GET', base_url = None, params=None, tag = None, key = None, secret = None ):
         if tag == None:
             raise(AwsUrlException("Associate tag is a required parameter"))
         else:
@@ -45,12 +208,12 @@ class AwsUrl(object):
         else:
             self.secret = secret
         if base_url == None:
-            self.base_url = 'http://webservices.amazon.com/onca/xml'
+            self.base_url = AwsSigner.base_url
         else:
             self.base_url = base_url
 
         self.method = method.upper()
-        self.params = params
+        self.params = dict(params or {})
 
     def add_param( self, key, value ):
         '''
@@ -58,57 +221,25 @@ class AwsUrl(object):
             URL parameters
         '''
         self.params[key] = value
-        
-    def signed_url(self):
-        if self.method == None:
-            self.method = 'GET'
-        # Add Timestamp to parameters
-        self.timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        # Really caller shouldn't but for testing against test vectors 
-        # makes it easier
-        if 'Timestamp' not in self.params:
-            self.params['Timestamp'] = self.timestamp
-
-        # Add Access Key to params
-        if 'AWSAccessKeyId' not in self.params:
-            self.params['AWSAccessKeyId'] = self.key
-        else:
+
+    def _signer(self):
+        if 'AWSAccessKeyId' in self.params:
             self.key = self.params['AWSAccessKeyId']
-        if 'AssociateTag' not in self.params:
-            self.params['AssociateTag'] = self.tag
-            
-        if 'Version' not in self.params:
-            self.params['Version'] = '2009-01-06'
-
-        ''' For aws must create a string with parameters sorted and then
-            connected by ampersands and of course must escape it all.
-        '''
-        # Convert dictionary of parameters into list of tuples for sorting
-        paramset = [(quote(k),quote(v)) for k,v in self.params.iteritems()]
-        paramset.sort() # mutable paramset will sort
-        # Recombine into & separated list of parameters
-        paramstring = '&'.join(['%s=%s' % (k, v) for k, v in paramset])
-        #paramstring ="&".join("%s=%s" % (k, urllib.quote(unicode(kwargs[k]).encode('utf-8'), safe = '~')) for k in paramset) 
-        # Now form signature
-        msg = self.method + "\n" + 'webservices.amazon.com' + "\n" + \
-            '/onca/xml' + "\n" + paramstring
+        return get_signer(self.key, self.secret, self.tag, self.method, self.base_url)
+
+    def canonical_query(self):
         '''
-        print '--------------------------------------------------------------------'
-        print 'For signing:'
-        print msg
-        print '--------------------------------------------------------------------'
+            The sorted and escaped parameter string that signed_url signs but
+            without the Timestamp and Signature.  So it is the same for every
+            request asking for the same thing which makes it the key for
+            caching responses.
         '''
-        m = hmac.new(key=self.secret, digestmod=hashlib.sha256)
-        m.update(msg)
-        digest = m.digest()
-        # Base64 encode to string and then escape it for final signature
-        signature = base64.encodestring(digest).strip()
-        ####
-        # I bet this will be a problem. Might escape things that
-        # shouldn't be?  Only supposed to escape '=' and '+'
-        signature = quote(signature)
+        return self._signer().canonical_query(self.params)
 
-        return self.base_url + '?' + paramstring + '&Signature=' + signature
+    def signed_url(self):
+        if self.method == None:
+            self.method = 'GET'
+        return self._signer().sign(self.params)
 
 if __name__ == '__main__':
     print 'Testing module aws_url'
@@ -161,7 +292,7 @@ if __name__ == '__main__':
 
     # Now try actually fecthing the url obtained from processing test vector [1]
     #webbrowser.open_new_tab( url_signed )
-    f = urlopen( url_signed )
+    f = AwsConnectionPool().urlopen( url_signed )
     dom = parse(f)
     f.close()
     f = open('aws.xml', 'w')
@@ -0,0 +1,36 @@
+#! /usr/bin/env python
+'''
+    Offline ItemSearch and ItemLookup responses for the benchmarks, made
+    by aws_fixtures.  They are always the same so results can be compared
+    between releases.  Running this writes them into the fixtures directory:
+
+        python benchmarks/fixtures.py
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'awspyapi'))
+from aws_fixtures import response_xml
+
+# name: (Operation, number of items, characters of EditorialReview)
+fixtures = {
+    'search_1': ('ItemSearch', 1, 4000),
+    'search_10': ('ItemSearch', 10, 4000),
+    'search_100': ('ItemSearch', 100, 4000),
+    'lookup_1': ('ItemLookup', 1, 4000),
+    'lookup_10': ('ItemLookup', 10, 4000),
+}
+
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def fixture_path(name):
+    return os.path.join(fixture_dir, name + '.xml')
+
+def write_fixtures():
+    for name, (operation, count, review_size) in sorted(fixtures.items()):
+        f = open(fixture_path(name), 'w')
+        f.write(response_xml(operation, count, review_size))
+        f.close()
+
+if __name__ == '__main__':
+    write_fixtures()
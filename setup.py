@@ -4,12 +4,13 @@ except ImportError:
         from distutils.core import setup
 
 setup(name='python-amazon-api',
-        version='0.5.10',
+        version='0.6.24',
         description="A Python module for accessing Amazon's Product Advertising API",
         long_description=open('README.rst').read() + '\n\n' + open('HISTORY.rst').read(),
         author='Mike Taylor',
         author_email='mike@taylorwebhome.org',
         packages = ['awspyapi'],
+        extras_require={'bulk': ['futures; python_version < "3"']},
         url="git://github.com/yatinla/python-amazon-api.git",
         download_url="git://github.com/yatinla/python-amazon-api.git",
         license=open('LICENSE').read,
@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+'''
+    Tests of the caches keeping to the expiry and sizes they are given.
+
+        python -m unittest discover -s tests
+'''
+import cPickle as pickle
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'awspyapi'))
+from aws_cache import AwsMemoryCache, AwsSqliteCache, AwsTieredCache
+from aws_parse import AwsResponse
+from aws_item import AwsItem
+
+def response(*asins):
+    return AwsResponse([AwsItem(asin) for asin in asins])
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_memory_expires(self):
+        cache = AwsMemoryCache(ttl=3600)
+        now = time.time()
+        cache.put('a', 'ItemLookup', response('B000000001'), 100)
+        cache.put('b', 'ItemLookup', response('B000000002'), 100, now + 5)
+        cache.put('c', 'ItemLookup', response('B000000003'), 100, now + 7200)
+        cache.put('d', 'ItemLookup', response('B000000004'), 100, now - 1)
+        self.assertTrue(cache.entry('a')[3] > now + 3500)
+        self.assertEqual(cache.entry('b')[3], now + 5)
+        ''' Never later than its own ttl '''
+        self.assertTrue(cache.entry('c')[3] <= time.time() + 3600)
+        self.assertEqual(cache.get('d'), None)
+
+    def test_tiered_keeps_expiry(self):
+        ''' A response copied from disk into memory expires when it does on disk '''
+        disk = AwsSqliteCache(self.path, ttl=10)
+        disk.put('k', 'ItemLookup', response('B000000001'), 1234)
+        expires = disk.entry('k')[3]
+        memory = AwsMemoryCache(ttl=3600)
+        tiered = AwsTieredCache(memory, disk)
+        found, operation, size, when = tiered.entry('k')
+        self.assertEqual(found[0].asin, 'B000000001')
+        self.assertEqual(when, expires)
+        self.assertEqual(memory.entry('k')[3], expires)
+
+    def test_tiered_sizes(self):
+        ''' Memory counts the size of the XML, even of a response copied from
+            disk, and disk the pickled size '''
+        disk = AwsSqliteCache(self.path)
+        memory = AwsMemoryCache()
+        tiered = AwsTieredCache(memory, disk)
+        tiered.put('k', 'ItemLookup', response('B000000001'), 5000)
+        self.assertEqual(memory.stats()['bytes'], 5000)
+        self.assertNotEqual(disk.stats()['bytes'], 5000)
+        memory.clear()
+        self.assertEqual(tiered.entry('k')[2], 5000)
+        self.assertEqual(memory.stats()['bytes'], 5000)
+
+    def test_old_database(self):
+        ''' A database from before xml_size gets the column and its rows give
+            their pickled size '''
+        db = sqlite3.connect(self.path)
+        db.execute('''CREATE TABLE responses (key TEXT PRIMARY KEY, operation TEXT, expires REAL,
+                        used REAL, size INTEGER, data BLOB)''')
+        data = pickle.dumps(response('B000000001'), 2)
+        db.execute('INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                   ('k', 'ItemLookup', time.time() + 60, time.time(), len(data), sqlite3.Binary(data)))
+        db.commit()
+        db.close()
+        cache = AwsSqliteCache(self.path)
+        found, operation, size, expires = cache.entry('k')
+        self.assertEqual(found[0].asin, 'B000000001')
+        self.assertEqual(size, len(data))
+        cache.put('j', 'ItemLookup', response('B000000002'), 700)
+        self.assertEqual(cache.entry('j')[2], 700)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+'''
+    Tests of writing items as CSV and JSON Lines.
+
+        python -m unittest discover -s tests
+'''
+import csv
+import json
+import os
+import sys
+import unittest
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'awspyapi'))
+from aws_item import AwsItem
+from aws_export import AwsCsvWriter, AwsJsonLinesWriter
+
+def make_item():
+    item = AwsItem('B000000001')
+    item.title = u'Am\xe9lie'
+    item.actors = ['Audrey Tautou', 'Mathieu Kassovitz']
+    item.running_time = '122 minutes'
+    item.editorial_reviews = [('Product Description', u'A caf\xe9 waitress'),
+                              ('Amazon.com', 'Whimsical'), ('Amazon.com', None)]
+    return item
+
+class CsvTest(unittest.TestCase):
+    def rows(self, columns, items):
+        f = StringIO()
+        AwsCsvWriter(f, columns).write(items)
+        return list(csv.reader(StringIO(f.getvalue())))
+
+    def test_editorial_reviews(self):
+        ''' A list of (Source, Content) tuples, one with no Content '''
+        rows = self.rows(['asin', 'editorial_reviews'], [make_item()])
+        self.assertEqual(rows[0], ['asin', 'editorial_reviews'])
+        self.assertEqual(rows[1], ['B000000001',
+            u'Product Description: A caf\xe9 waitress; Amazon.com: Whimsical; Amazon.com'.encode('utf-8')])
+
+    def test_lists_and_conversions(self):
+        rows = self.rows(['title', 'actors', 'running_time', 'directors', 'list_price'], [make_item()])
+        self.assertEqual(rows[1], [u'Am\xe9lie'.encode('utf-8'), 'Audrey Tautou; Mathieu Kassovitz',
+                                   '122', '', ''])
+
+class JsonLinesTest(unittest.TestCase):
+    def test_editorial_reviews(self):
+        f = StringIO()
+        AwsJsonLinesWriter(f, ['asin', 'editorial_reviews']).write([make_item()])
+        record = json.loads(f.getvalue().decode('utf-8'))
+        self.assertEqual(record['editorial_reviews'][0], [u'Product Description', u'A caf\xe9 waitress'])
+
+if __name__ == '__main__':
+    unittest.main()